@@ -0,0 +1,201 @@
+
+# Micro-benchmark of import_lyrics.normalize_lyrics() against the original
+# implementation (kept below as the reference), checking that both give the
+# same output.
+#
+#     % python bench_lyrics.py [lyrics.json]
+#
+# Uses the lyrics in lyrics.json if it exists, otherwise a synthetic corpus
+# with the quirks the normalizer handles (entities, smart quotes, dashes,
+# control characters, credits, section names, repeats).
+
+import sys
+import time
+import json
+import re
+import html
+import unicodedata
+
+import import_lyrics
+
+# The original normalizer
+
+def reference_repeat_line(s):
+    # Check if string ends with " x" followed by a digit
+    match = re.search(r' x(\d)$', s)
+    
+    if match:
+        num = int(match.group(1)) # Get the digit
+        base_string = s[:-3] # Remove the " x\d" from the string
+        return [base_string] * num  # Return array with string repeated num times
+    else:
+        return [s] # Return array with string appearing once
+
+def reference_is_credits_or_section_name(line):
+    # List of specific credits patterns
+    credits_patterns = [
+        "(Lennon/McCartney)",
+        "(Kesler/Feathers)",
+        "(Berry)",
+        "(Wilkin/Westberry)",
+        "(Fontaine/Calacrai/Lampert/Gluck)",
+        "(J and D Burnette/Burlison/Mortimer)",
+        "(Traditional, arranged by Tony Sheridan)",
+        "(Intro)",
+        "(Bryant)",
+        "(Williams)",
+        "(Goffin/King)",
+        "[Ringo Starr & *Paul McCartney*]",
+        "(Solo John Lennon)",
+        "[spoken]",
+        "[Past Masters/single version only:"
+    ]
+
+    credits_patterns = [c for c in credits_patterns]
+    
+    # Section patterns using regex
+    section_patterns = [
+        r"\[Repetition( \d)?\]? ?:? ?(x\d)?",
+        r"\[Refrain\]? ?:? ?(x\d)?",
+        r"Verse \d:",
+        r"Chorus(.*:)?"
+    ]
+    
+    # Check if line matches any credits pattern
+    if line in credits_patterns:
+        # print(f'        omitting line "{line}"') # for debugging
+        return True
+        
+    # Check if line matches any section pattern
+    for pattern in section_patterns:
+        if re.match(f"^{pattern}$", line, re.IGNORECASE):
+            # print(f'        omitting line "{line}"') # for debugging
+            return True
+            
+    return False
+
+def reference_normalize_lyrics(text):
+    """Sanitizes text by removing or replacing unwanted characters and normalizing whitespace."""
+    if not text:
+        return ""
+
+    text = str(text) # Convert to string if not already
+    text = html.unescape(text) # Decode HTML entities
+
+    # Normalize multiple newlines to maximum of two
+    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    
+    # Split into lines
+    lines = text.split('\n')
+
+    cleaned_lines = []
+    for line in lines:
+        new_line = line
+
+        # Replace smart quotes with regular quotes
+        new_line = new_line.replace('“', '"').replace('”', '"')
+        new_line = new_line.replace('‘', "'").replace('’', "'")
+
+        # Replace emdash with comma+space (this only occurs in "You've Really Got A Hold On Me")
+        new_line = new_line.replace("—", ", ").replace("–", ", ").replace("&emdash;", ", ")
+
+        # Replace this mess with a quote (occurs in "Christmastime" and some others)
+        new_line = new_line.replace("&amp;quot;", '"')
+        
+        new_line = unicodedata.normalize('NFKD', new_line) # Normalize unicode characters
+
+        # Remove control characters except newline
+        new_line = ''.join(ch for ch in new_line if unicodedata.category(ch)[0] != "C")
+
+        # Replace multiple whitespace with single space
+        new_line = re.sub(r'[ \t]+', ' ', new_line)
+        
+        # Remove non-ASCII characters but keep basic punctuation
+        new_line = re.sub(r'[^\x20-\x7E\u2018\u2019\u201C\u201D]', '', new_line)
+
+        # Strip whitespace
+        new_line = new_line.strip()
+
+        # Idiosyncratic modifications
+        new_line = new_line.removesuffix("(fade out)")
+        new_line = new_line.removesuffix("[music continues and fades to background]")
+        new_line = new_line.replace("Get back, get back, get back...]", "Get back, get back, get back...")
+        new_line = new_line.strip()
+
+        if not reference_is_credits_or_section_name(new_line):
+            cleaned_lines += reference_repeat_line(new_line)
+
+    # Join the lines and renormalize line breaks to a maximum of two
+    text = "\n".join(cleaned_lines)
+    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    return text
+
+SYNTHETIC_LINES = [
+    "(Lennon/McCartney)",
+    "Verse 1:",
+    "Close your eyes and I&#39;ll kiss you, tomorrow I&#39;ll miss you",
+    "Remember I&rsquo;ll always be true",
+    "And then while I&#8217;m away",
+    "I&#8217;ll write home ev&#8217;ry day  \t and I&#8217;ll send all my loving to you",
+    "“All my loving” — I will send to you x2",
+    "",
+    "",
+    "",
+    "[Refrain] x2",
+    "Chorus (repeat):",
+    "Cest la vie, Michelle, ma belle\x07",
+    "Ob-la-di, ob-la-da – life goes on, bra",
+    "&amp;quot;Christmastime&amp;quot; is here again &emdash; again",
+    "Na na na na na na na, na na na na, hey Jude (fade out)",
+    "Get back, get back, get back...]",
+    "[Repetition 2]: x3",
+    "Ｆｕｌｌｗｉｄｔｈ　ｌｉｎｅ",
+    "  She loves you, yeah, yeah, yeah  ",
+]
+
+def synthetic_corpus(count=200):
+    songs = []
+    for i in range(count):
+        lines = SYNTHETIC_LINES[i % 7:] + SYNTHETIC_LINES[:i % 7]
+        songs.append("\n".join(lines * 3))
+    return songs
+
+def load_corpus(filename):
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            songs = json.load(file)
+    except FileNotFoundError:
+        return synthetic_corpus()
+
+    texts = [value for song in songs for key, value in song.items()
+             if key != "title" and isinstance(value, str)]
+    return texts or synthetic_corpus()
+
+def bench(function, texts, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    texts = load_corpus(sys.argv[1] if len(sys.argv) > 1 else "lyrics.json")
+
+    mismatches = [text for text in texts
+                  if import_lyrics.normalize_lyrics(text) != reference_normalize_lyrics(text)]
+    if mismatches:
+        print(f"{len(mismatches)} of {len(texts)} texts normalize differently, e.g.:")
+        print(repr(mismatches[0][:200]))
+        sys.exit(1)
+
+    reference = bench(reference_normalize_lyrics, texts)
+    compiled = bench(import_lyrics.normalize_lyrics, texts)
+    for name, seconds in [("reference", reference), ("compiled", compiled)]:
+        print(f"{name:>10}: {len(texts) / seconds:10.0f} songs/s  "
+              f"({seconds / len(texts) * 1e6:.1f} us/song)")
+    print(f"   speedup: {reference / compiled:.2f}x, identical output on {len(texts)} texts")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+
+# Benchmark of serve.py against "python -m http.server" (the old GO script),
+# fetching a file the way the graphs page does: first loads, gzip-accepting
+# loads, and reloads that revalidate with If-None-Match.
+#
+#     % python bench_serve.py [FILENAME] [CLIENTS] [REQUESTS]
+#
+# FILENAME defaults to beatles_songs.json and is looked up in the current
+# directory, which is served. Both servers run in this process on free ports.
+
+import os
+import sys
+import time
+import threading
+import http.client
+import http.server
+
+import serve
+
+def start_server(handler_class, directory):
+    class QuietHandler(handler_class):
+        def log_message(self, format, *args):
+            pass
+
+    def handler(*args, **kwargs):
+        return QuietHandler(*args, directory=directory, **kwargs)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# One client's loop. Appends (requests, bytes) to results.
+def client(port, path, headers, count, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    received = 0
+    for _ in range(count):
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        received += len(response.read())
+        if response.will_close:
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.close()
+    results.append((count, received))
+
+def bench(port, path, headers, clients, requests):
+    results = []
+    threads = [threading.Thread(target=client, args=(port, path, headers, requests, results))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return (sum(count for count, _ in results) / seconds,
+            sum(received for _, received in results) / sum(count for count, _ in results))
+
+def etag_of(port, path, headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("HEAD", path, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.getheader("ETag")
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else "beatles_songs.json"
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    directory = os.getcwd()
+    if not os.path.isfile(os.path.join(directory, filename)):
+        sys.exit(f"{filename} not found in {directory}")
+    print(f"Precompressed {serve.precompress(directory)} files")
+
+    path = "/" + filename
+    baseline = start_server(http.server.SimpleHTTPRequestHandler, directory)
+    server = start_server(serve.Handler, directory)
+    compressed = {"Accept-Encoding": "br, gzip"}
+    etag = etag_of(server.server_address[1], path, compressed)
+
+    cases = [
+        ("http.server", baseline, {}),
+        ("serve.py", server, {}),
+        ("serve.py gzip", server, {"Accept-Encoding": "gzip"}),
+        ("serve.py br", server, compressed),
+        ("serve.py 304", server, dict(compressed, **{"If-None-Match": etag})),
+    ]
+    if serve.brotli is None:
+        # The br case would measure gzip again.
+        print("Install brotli to also benchmark br.")
+        cases = [case for case in cases if case[0] != "serve.py br"]
+    for name, s, headers in cases:
+        rate, size = bench(s.server_address[1], path, headers, clients, requests)
+        print(f"{name:>14}: {rate:8.0f} requests/s, {size:10.0f} bytes/response")
+
+    baseline.shutdown()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+
+# Build the small files the graphs page loads instead of all of
+# beatles_songs.json:
+#
+# - stats.json: for each graphed metric, the mean, sample standard deviation
+#   and count of the values at each x (the year, for most graphs), for all
+#   songs and for Lennon songs only.
+# - song_points.json: the points to plot, as [x, y, song index] triples per
+#   metric, plus the title of each song and whether it's a Lennon song.
+#
+# Rerun after importing new data:
+#
+#     % python build_stats.py
+
+import json
+import math
+
+import db
+import derive_features
+
+STATS_FILENAME = "stats.json"
+POINTS_FILENAME = "song_points.json"
+
+# Top-level keys the metrics need.
+FIELDS = ["title", "yendor", "pannell", "chadwambles", "TheHoleGotFixed", "isophonics"]
+
+# Years the graphs cover.
+FIRST_YEAR = 1962
+LAST_YEAR = 1970
+
+# Decimal places kept in the output.
+PRECISION = 4
+
+def year(song):
+    return song["yendor"].get("year")
+
+def distinct_chords(song, derived):
+    # Use the precomputed value unless the sidecar is out of date
+    features = derived.get(song["title"])
+    if features is None or features.get("sourceHash") != derive_features.source_hash(song):
+        features = derive_features.chord_features(song)
+    return features.get("distinctChords")
+
+def number_of_chords(song, derived):
+    if song.get("pannell", {}).get("album", {}).get("Original_songs") != 1:
+        return None
+    return distinct_chords(song, derived)
+
+def top_50_billboard(song, derived):
+    value = song["yendor"].get("top.50.billboard")
+    return None if value == -1 else value
+
+def composer_share_paul(song, derived):
+    album = song.get("pannell", {}).get("album", {})
+    john, paul = album.get("Composer_share_John"), album.get("Composer_share_Paul")
+    if john is None or paul is None or abs(john + paul - 1) >= 0.01:
+        return None
+    return paul
+
+def first_tempo(song, derived):
+    tempos = song.get("TheHoleGotFixed", {}).get("tempos")
+    return tempos[0] if tempos else None
+
+def chadwambles(field):
+    return lambda song, derived: song.get("chadwambles", {}).get(field)
+
+# (name, graph title, x axis format, x function, y function). The functions
+# take the song and the derived features and return None to leave the song
+# out of the graph.
+METRICS = [
+    ("duration", "Duration (Seconds)", "4d", None,
+     lambda song, derived: song["yendor"].get("duration")),
+    ("number_of_chords", "Number of Chords (Originals)", "4d", None, number_of_chords),
+    ("number_of_takes", "Number of Takes", "4d", None,
+     lambda song, derived: song.get("pannell", {}).get("album", {}).get("Takes")),
+    ("tempo", "Tempo (BPM)", "4d", None, first_tempo),
+    ("paul_billboard", "Paul Authorship (vs John) vs. Billboard", ".1f",
+     composer_share_paul, top_50_billboard),
+    ("top50", "Top 50 Billboard", "4d", None, top_50_billboard),
+    ("acousticness", "Acousticness", "4d", None, chadwambles("acousticness")),
+    ("danceability", "Danceability", "4d", None, chadwambles("danceability")),
+    ("energy", "Energy", "4d", None, chadwambles("energy")),
+    ("liveness", "Liveness", "4d", None, chadwambles("liveness")),
+    ("speechiness", "Speechiness", "4d", None, chadwambles("speechiness")),
+    ("valence", "Valence", "4d", None, chadwambles("valence")),
+]
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def rounded(value):
+    return round(value, PRECISION) if isinstance(value, float) else value
+
+# List of {"x", "mean", "stddev", "count"} sorted by x, for the [x, y, ...]
+# points. The standard deviation is the sample one, 0 for a single value.
+def group_stats(points):
+    by_x = {}
+    for x, y, *_ in points:
+        by_x.setdefault(x, []).append(y)
+
+    stats = []
+    for x in sorted(by_x):
+        values = by_x[x]
+        mean = sum(values) / len(values)
+        if len(values) > 1:
+            stddev = math.sqrt(sum((value - mean)**2 for value in values) / (len(values) - 1))
+        else:
+            stddev = 0
+        stats.append({"x": x, "mean": rounded(mean), "stddev": rounded(stddev), "count": len(values)})
+
+    return stats
+
+def build(songs, derived):
+    titles = []
+    lennon = []
+    points = {name: [] for name, *_ in METRICS}
+
+    for song in songs:
+        if "yendor" not in song or not is_number(year(song)) \
+                or not FIRST_YEAR <= year(song) <= LAST_YEAR:
+            continue
+
+        index = len(titles)
+        titles.append(song["title"])
+        lennon.append(song["yendor"].get("songwriter") == "Lennon")
+
+        for name, _, _, x_function, y_function in METRICS:
+            x = year(song) if x_function is None else x_function(song, derived)
+            y = y_function(song, derived)
+            if is_number(x) and is_number(y):
+                points[name].append([rounded(x), rounded(y), index])
+
+    stats = {
+        "metrics": [{"id": name, "title": title, "format": format}
+                    for name, title, format, _, _ in METRICS],
+        "all": {name: group_stats(points[name]) for name in points},
+        "lennon": {name: group_stats([point for point in points[name] if lennon[point[2]]])
+                   for name in points},
+    }
+    song_points = {"titles": titles, "lennon": lennon, "points": points}
+
+    return stats, song_points
+
+def write_json(data, filename):
+    encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    return db.write_atomically(filename, encoder.iterencode(data))
+
+def main():
+    stats, song_points = build(db.iter_songs(FIELDS), derive_features.load_derived())
+
+    for data, filename in [(stats, STATS_FILENAME), (song_points, POINTS_FILENAME)]:
+        write_json(data, filename)
+        print(f"Wrote {filename}")
+
+if __name__ == "__main__":
+    main()
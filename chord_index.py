@@ -0,0 +1,279 @@
+
+# Search the isophonics chords and keys of all songs: find the songs with a
+# chord progression, given as Roman numerals relative to the key, or with a
+# modulation from one key to another.
+#
+#     % python chord_index.py "I-vi-IV-V"
+#     % python chord_index.py --modulation E G
+#
+#     >>> index = chord_index.ChordIndex(db.iter_songs(["title", "isophonics"]))
+#     >>> index.find_progression("I-vi-IV-V")     # [(title, begin time, end time), ...]
+#     >>> index.find_modulation("E", "G")         # [(title, time), ...]
+#
+# Each chord is converted to a degree (semitones above the tonic of the key
+# that keylab gives at that time) and a quality (major, minor, diminished,
+# augmented or suspended), so progressions match in any key. Repeated chords
+# are counted once, so "I-IV" also matches I I IV, and "no chord" (N) breaks
+# a progression. An inverted index from each n-gram of up to MAX_NGRAM chords
+# to its positions finds candidates without scanning the events; longer
+# queries are checked against the chord sequence at each candidate.
+
+import re
+import sys
+import argparse
+
+import db
+import isophonics
+
+# Longest chord n-gram that gets an index entry.
+MAX_NGRAM = 4
+
+# Chord labels meaning "no chord" and "unknown chord".
+NO_CHORDS = {"N", "X"}
+
+# Short names of modes, as used in chord labels.
+MODE_NAMES = {"maj": "major", "min": "minor"}
+
+NOTE_PITCHES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+ACCIDENTALS = {"b": -1, "#": 1, "♭": -1, "♯": 1}
+
+# Roman numeral of each degree in semitones above the tonic.
+NUMERALS = ["I", "bII", "II", "bIII", "III", "IV", "#IV", "V", "bVI", "VI", "bVII", "VII"]
+NUMERAL_DEGREES = {"I": 0, "II": 2, "III": 4, "IV": 5, "V": 7, "VI": 9, "VII": 11}
+
+# Suffix of the numeral of each quality. Minor and diminished numerals are
+# also lowercase.
+QUALITY_SUFFIXES = {"maj": "", "min": "", "dim": "o", "aug": "+", "sus": "sus"}
+
+# Roman numeral in a query: accidental, numeral, quality, and any extension
+# (ignored, e.g. the 7 in V7).
+NUMERAL_RE = re.compile(r"^([b#♭♯]?)(VII|VI|IV|V|III|II|I|vii|vi|iv|v|iii|ii|i)(o|°|dim|\+|aug|sus)?[0-9]*$")
+QUERY_SEPARATOR_RE = re.compile(r"[\s,\-–—]+")
+
+# Pitch class of a note name such as "E", "Bb" or "F#", or None.
+def pitch_class(note):
+    if not note or note[0] not in NOTE_PITCHES:
+        return None
+
+    pitch = NOTE_PITCHES[note[0]]
+    for accidental in note[1:]:
+        if accidental not in ACCIDENTALS:
+            return None
+        pitch += ACCIDENTALS[accidental]
+
+    return pitch % 12
+
+# (tonic pitch class, mode) of a keylab key such as "E" or "C#:minor", or
+# None. "min" and "maj" are read as "minor" and "major".
+def parse_key(key):
+    tonic, _, mode = key.partition(":")
+    pitch = pitch_class(tonic.strip())
+    if pitch is None:
+        return None
+
+    mode = mode.strip().lower() or "major"
+    return pitch, MODE_NAMES.get(mode, mode)
+
+# Quality class of a Harte chord quality such as "maj", "min7" or "sus4(b7)".
+def chord_quality(quality):
+    quality = quality.split("(")[0]
+    if quality.startswith("min"):
+        return "min"
+    if quality in ("dim", "dim7", "hdim7"):
+        return "dim"
+    if quality.startswith("aug"):
+        return "aug"
+    if quality.startswith("sus"):
+        return "sus"
+    return "maj"
+
+# (root pitch class, quality class) of a chord label such as "A:min7/b3", or
+# None for no chord or a label we can't read.
+def parse_chord(label):
+    if label in NO_CHORDS:
+        return None
+
+    root, _, quality = label.split("/")[0].partition(":")
+    pitch = pitch_class(root)
+    if pitch is None:
+        return None
+
+    return pitch, chord_quality(quality or "maj")
+
+# Roman numeral of a (degree, quality) chord, e.g. (9, "min") -> "vi".
+def numeral(chord):
+    degree, quality = chord
+    name = NUMERALS[degree]
+    if quality in ("min", "dim"):
+        name = name[:-len(name.lstrip("b#"))] + name.lstrip("b#").lower()
+    return name + QUALITY_SUFFIXES[quality]
+
+# List of (degree, quality) chords of a query such as "I-vi-IV-V". A chord
+# repeated back to back counts once, as in the index.
+def parse_progression(query):
+    chords = []
+
+    for token in QUERY_SEPARATOR_RE.split(query.strip()):
+        match = NUMERAL_RE.match(token)
+        if match is None:
+            raise ValueError(f"Can't read chord {token!r} in {query!r}")
+        accidental, roman, suffix = match.groups()
+
+        degree = (NUMERAL_DEGREES[roman.upper()] + ACCIDENTALS.get(accidental, 0)) % 12
+        if suffix in ("o", "°", "dim"):
+            quality = "dim"
+        elif suffix in ("+", "aug"):
+            quality = "aug"
+        elif suffix == "sus":
+            quality = "sus"
+        else:
+            quality = "maj" if roman.isupper() else "min"
+        if not chords or chords[-1] != (degree, quality):
+            chords.append((degree, quality))
+
+    return chords
+
+# List of (begin time, end time, (tonic, mode)) of the song's key sections.
+def key_sections(song):
+    sections = []
+    for event in isophonics.events(song, "keylab"):
+        key = parse_key(event["key"]) if "key" in event else None
+        if key is not None:
+            sections.append((event["beginTime"], event["endTime"], key))
+
+    return sections
+
+# The song's chords relative to the key, as a list of runs: lists of
+# ((degree, quality), begin time, end time) with no "no chord" and no chord
+# repeated back to back. Chords before the first key section use its key, and
+# chords in silence between sections use the previous key.
+def relative_chords(song):
+    sections = key_sections(song)
+    if not sections:
+        return []
+
+    runs = []
+    run = []
+    section = 0
+    for event in isophonics.events(song, "chordlab"):
+        chord = parse_chord(event.get("chord", "N"))
+        if chord is None:
+            if run:
+                runs.append(run)
+            run = []
+            continue
+
+        begin_time, end_time = event["beginTime"], event["endTime"]
+        while section + 1 < len(sections) and sections[section + 1][0] <= begin_time:
+            section += 1
+        tonic = sections[section][2][0]
+        relative = ((chord[0] - tonic) % 12, chord[1])
+
+        if run and run[-1][0] == relative:
+            run[-1] = (relative, run[-1][1], end_time)
+        else:
+            run.append((relative, begin_time, end_time))
+    if run:
+        runs.append(run)
+
+    return runs
+
+class ChordIndex:
+    def __init__(self, songs):
+        self.titles = []
+        # List of chord runs (see relative_chords()), and the song number of
+        # each run.
+        self.runs = []
+        self.run_songs = []
+        # Map from tuple of up to MAX_NGRAM chords to list of (run number,
+        # position in the run).
+        self.ngrams = {}
+        # Map from (from key, to key) to list of (song number, time).
+        self.modulations = {}
+
+        for song in songs:
+            song_number = len(self.titles)
+            self.titles.append(song["title"])
+
+            for run in relative_chords(song):
+                run_number = len(self.runs)
+                self.runs.append(run)
+                self.run_songs.append(song_number)
+                chords = [chord for chord, _, _ in run]
+                for position in range(len(chords)):
+                    for n in range(1, min(MAX_NGRAM, len(chords) - position) + 1):
+                        ngram = tuple(chords[position:position + n])
+                        self.ngrams.setdefault(ngram, []).append((run_number, position))
+
+            sections = key_sections(song)
+            for (_, _, from_key), (begin_time, _, to_key) in zip(sections, sections[1:]):
+                if from_key != to_key:
+                    self.modulations.setdefault((from_key, to_key), []).append((song_number, begin_time))
+
+    # List of (title, begin time, end time) of each occurrence of the
+    # progression, a string such as "I-vi-IV-V" or a list of (degree,
+    # quality) chords.
+    def find_progression(self, progression):
+        if isinstance(progression, str):
+            progression = parse_progression(progression)
+        progression = tuple(progression)
+        if not progression:
+            return []
+
+        matches = []
+        for run_number, position in self.ngrams.get(progression[:MAX_NGRAM], []):
+            run = self.runs[run_number]
+            end = position + len(progression)
+            if len(progression) > MAX_NGRAM:
+                if end > len(run) or tuple(chord for chord, _, _ in run[position:end]) != progression:
+                    continue
+            matches.append((self.titles[self.run_songs[run_number]], run[position][1], run[end - 1][2]))
+
+        return matches
+
+    # List of (title, time) of each change from the key to the other, given
+    # as strings such as "E" or "C#:minor".
+    def find_modulation(self, from_key, to_key):
+        keys = []
+        for key in [from_key, to_key]:
+            parsed = parse_key(key)
+            if parsed is None:
+                raise ValueError(f"Can't read key {key!r}")
+            keys.append(parsed)
+
+        return [(self.titles[song_number], time)
+                for song_number, time in self.modulations.get(tuple(keys), [])]
+
+def format_time(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}:{seconds:05.2f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the isophonics chords and keys.")
+    parser.add_argument("progression", nargs="?", help='Roman numerals, e.g. "I-vi-IV-V"')
+    parser.add_argument("--modulation", nargs=2, metavar=("FROM", "TO"),
+                        help="keys, e.g. E G or C#:minor E")
+    args = parser.parse_args()
+    if args.progression is None and args.modulation is None:
+        parser.error("give a progression or --modulation")
+
+    index = ChordIndex(db.iter_songs(["title", "isophonics"]))
+
+    try:
+        if args.progression is not None:
+            progression = parse_progression(args.progression)
+            print("Progression:", " ".join(map(numeral, progression)))
+            matches = index.find_progression(progression)
+            for title, begin_time, end_time in matches:
+                print(f"{title}: {format_time(begin_time)}-{format_time(end_time)}")
+        else:
+            matches = index.find_modulation(*args.modulation)
+            for title, time in matches:
+                print(f"{title}: {format_time(time)}")
+    except ValueError as e:
+        sys.exit(str(e))
+
+    print(f"{len(matches)} matches")
+
+if __name__ == "__main__":
+    main()
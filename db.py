@@ -1,22 +1,451 @@
-
 import os
+import re
 import json
+import math
+import mmap
+import shutil
+import hashlib
+import tempfile
+import collections
+import unicodedata
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the sharded layout then doesn't lock.
+    fcntl = None
 
 FILENAME = "beatles_songs.json"
 
-def load():
-    with open(FILENAME) as f:
-        return json.load(f)
+# Sharded layout: one JSON file per song in this directory, plus a manifest
+# listing each song's title, file and content hash.
+SHARD_DIR = "beatles_songs"
+MANIFEST_FILENAME = "manifest.json"
+
+# Sidecar of FILENAME, written by save_json(), with the byte offsets of each
+# song's top-level values, so that iter_songs(fields) only parses those.
+OFFSETS_SUFFIX = ".offsets"
+
+# Which layout load(), save() and iter_songs() use: "json" for the single
+# FILENAME, "shards" for SHARD_DIR, or "sqlite" for the SQLite file (see
+# db_sqlite.py).
+STORAGE = os.environ.get("BEATLESDB_STORAGE", "json")
+
+NON_ALPHANUMERIC_RE = re.compile(r"[^a-z0-9]+")
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+# How much of the file iter_songs() reads at a time.
+READ_SIZE = 64*1024
+
+# Minimum trigram similarity for SongIndex.match() candidates.
+MIN_MATCH_SCORE = 0.5
+
+# How many of the rarest trigrams of the query a title must share to be a
+# SongIndex.match() candidate (see there).
+PREFIX_HITS = 3
+
+# If fields is given, each song only has those top-level keys, and the others
+# aren't parsed where the layout allows it (see iter_songs()). Such a partial
+# list of songs can't be saved.
+def load(fields=None):
+    if fields is not None:
+        return PartialSongs(iter_songs(fields), fields)
+
+    if STORAGE == "shards":
+        return load_shards()
+    if STORAGE == "sqlite":
+        import db_sqlite
+        return db_sqlite.load()
+
+    return load_json()
 
+# Returns whether anything was written.
 def save(songs):
-    # Keep a backup in case the save fails.
-    os.rename(FILENAME, FILENAME + ".bak")
+    if isinstance(songs, PartialSongs):
+        raise ValueError(f"Can't save songs loaded with only the fields {songs.fields}")
+
+    if STORAGE == "shards":
+        return save_shards(songs)
+    if STORAGE == "sqlite":
+        import db_sqlite
+        return db_sqlite.save(songs)
+
+    return save_json(songs)
+
+# Yield the songs in the database one at a time, without loading all of them.
+# If fields is given, each song only keeps those top-level keys. The single
+# JSON file's other values are then skipped without parsing them if its
+# offsets sidecar is up to date, and the SQLite backend doesn't read their
+# tables; shards are parsed whole.
+def iter_songs(fields=None):
+    if STORAGE == "shards":
+        return iter_shards(fields)
+    if STORAGE == "sqlite":
+        import db_sqlite
+        return db_sqlite.iter_songs(fields)
+
+    return iter_json(fields)
+
+# List of songs returned by load(fields), with only some of their keys.
+class PartialSongs(list):
+    def __init__(self, songs=(), fields=()):
+        super().__init__(songs)
+        self.fields = list(fields)
+
+def load_json(filename=FILENAME):
+    with open(filename) as f:
+        return json.load(f)
+
+def iter_json(fields=None, filename=FILENAME):
+    if fields is not None:
+        offsets = load_offsets(filename)
+        if offsets is not None:
+            return iter_json_fields(fields, offsets, filename)
+
+    return stream_json(fields, filename)
+
+# Yield the songs in the JSON file with just the fields, decoding only their
+# values, which the offsets locate.
+def iter_json_fields(fields, offsets, filename=FILENAME):
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for song_offsets in offsets:
+            song = {}
+            for key in fields:
+                span = song_offsets.get(key)
+                if span is not None:
+                    song[key] = json.loads(data[span[0]:span[1]])
+            yield song
+
+# List of the offsets of each song's values in the JSON file, as maps from
+# key to (start, end), or None if the sidecar is missing or the file was
+# changed since it was written.
+def load_offsets(filename=FILENAME):
+    try:
+        with open(filename + OFFSETS_SUFFIX) as f:
+            sidecar = json.load(f)
+        stat = os.stat(filename)
+    except (FileNotFoundError, ValueError):
+        return None
 
+    if sidecar.get("size") != stat.st_size or sidecar.get("mtimeNs") != stat.st_mtime_ns:
+        return None
+
+    return sidecar["songs"]
+
+# Yield the songs in the JSON file, parsing the file as it's read instead of
+# loading it all at once. Keys not in fields are dropped as each song is
+# parsed.
+def stream_json(fields=None, filename=FILENAME):
+    decoder = json.JSONDecoder()
+
+    with open(filename, encoding="utf-8") as f:
+        buffer = ""
+        position = 0
+        at_eof = False
+
+        # Drop the consumed part of the buffer and read more of the file.
+        # Returns False at the end of the file.
+        def fill(size=READ_SIZE):
+            nonlocal buffer, position, at_eof
+            if at_eof:
+                return False
+            data = f.read(size)
+            if not data:
+                at_eof = True
+                return False
+            buffer = buffer[position:] + data
+            position = 0
+            return True
+
+        # Return the next non-whitespace character without consuming it.
+        def peek():
+            nonlocal position
+            while True:
+                position = WHITESPACE_RE.match(buffer, position).end()
+                if position < len(buffer):
+                    return buffer[position]
+                if not fill():
+                    raise ValueError(f"Unexpected end of {filename}")
+
+        if peek() != "[":
+            raise ValueError(f"{filename} doesn't contain a list of songs")
+        position += 1
+        if peek() == "]":
+            return
+
+        while True:
+            peek()
+
+            # Decode the next song, reading more of the file until it's all
+            # in the buffer. Read twice as much each time so that a large
+            # song isn't reparsed too many times.
+            read_size = READ_SIZE
+            while True:
+                try:
+                    song, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not fill(read_size):
+                        raise
+                else:
+                    if end < len(buffer) or at_eof:
+                        break
+                    # The song may continue past the buffer (e.g. a number).
+                    fill(read_size)
+                read_size *= 2
+            position = end
+
+            if fields is not None:
+                song = {key: song[key] for key in fields if key in song}
+            yield song
+
+            separator = peek()
+            position += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Unexpected {separator!r} in {filename}")
+
+# Returns whether the file was written; it's left alone if nothing changed.
+# Also writes the offsets sidecar.
+def save_json(songs, filename=FILENAME):
     # Write to make git diffs more readable: Sort by song title, and sort keys.
-    with open(FILENAME, "w") as f:
-        json.dump(sorted(songs, key=lambda song: song["title"]), f, sort_keys=True, indent=4)
+    # The JSON is encoded a value at a time, so the whole encoded database is
+    # never held in memory.
+    offsets = []
+    chunks = encode_json(sorted(songs, key=lambda song: song["title"]), offsets)
+
+    # Keep a backup of the previous version.
+    written = write_atomically(filename, chunks, backup=True)
+
+    stat = os.stat(filename)
+    sidecar = {"size": stat.st_size, "mtimeNs": stat.st_mtime_ns, "songs": offsets}
+    write_atomically(filename + OFFSETS_SUFFIX, [json.dumps(sidecar, separators=(",", ":"))])
+
+    return written
+
+# Yield the songs encoded as JSON chunks, the same as
+# json.JSONEncoder(sort_keys=True, indent=4) would, and append to offsets, for
+# each song, a map from key to the (start, end) character offsets of its
+# value. The JSON is ASCII, so these are also byte offsets.
+def encode_json(songs, offsets):
+    encoder = json.JSONEncoder(sort_keys=True, indent=4)
+    if not songs:
+        yield "[]"
+        return
+
+    position = 0
+    for song_number, song in enumerate(songs):
+        chunk = ("[" if song_number == 0 else ",") + "\n    {"
+        song_offsets = {}
+        for key_number, key in enumerate(sorted(song)):
+            chunk += ("" if key_number == 0 else ",") + "\n        " + encoder.encode(key) + ": "
+            # The value is nested two levels deep.
+            value = encoder.encode(song[key]).replace("\n", "\n        ")
+            start = position + len(chunk)
+            song_offsets[key] = (start, start + len(value))
+            chunk += value
+        chunk += "\n    }" if song else "}"
+        offsets.append(song_offsets)
+        position += len(chunk)
+        yield chunk
+
+    yield "\n]"
+
+# List of songs loaded from the sharded layout. Remembers the hash of each
+# song as loaded, so that save_shards() only writes the songs that this
+# process changed, added or removed. Two importers can then work on
+# different songs at the same time.
+class ShardedSongs(list):
+    def __init__(self, songs=(), loaded_hashes=None):
+        super().__init__(songs)
+        # Map from title to content hash at load time.
+        self.loaded_hashes = loaded_hashes or {}
+
+# Filename of a song's shard, based on its title, e.g. "Help!" -> "help.json".
+def shard_filename(title, used_filenames):
+    slug = NON_ALPHANUMERIC_RE.sub("-", fold_to_ascii(title.lower())).strip("-") or "song"
+    filename = slug + ".json"
+    suffix = 2
+    while filename in used_filenames:
+        filename = f"{slug}-{suffix}.json"
+        suffix += 1
+
+    return filename
+
+def encode_song(song):
+    return json.dumps(song, sort_keys=True, indent=4)
+
+def load_manifest(shard_dir):
+    try:
+        with open(os.path.join(shard_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
 
+def load_shards(shard_dir=SHARD_DIR):
+    songs = ShardedSongs()
+
+    for entry in load_manifest(shard_dir):
+        with open(os.path.join(shard_dir, entry["file"])) as f:
+            encoded = f.read()
+        songs.append(json.loads(encoded))
+        songs.loaded_hashes[entry["title"]] = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    return songs
+
+def iter_shards(fields=None, shard_dir=SHARD_DIR):
+    for entry in load_manifest(shard_dir):
+        with open(os.path.join(shard_dir, entry["file"])) as f:
+            song = json.load(f)
+        if fields is not None:
+            song = {key: song[key] for key in fields if key in song}
+        yield song
+
+# Write the songs that changed since they were loaded, and update the
+# manifest. Songs that were loaded and are no longer in the list are removed.
+# If songs isn't from load_shards() (e.g. when converting from the single
+# JSON file), every song counts as changed. Returns whether anything was
+# written.
+def save_shards(songs, shard_dir=SHARD_DIR):
+    loaded_hashes = getattr(songs, "loaded_hashes", {})
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # Hold the lock while updating the manifest, so that concurrent saves
+    # each see the other's entries.
+    with open(os.path.join(shard_dir, MANIFEST_FILENAME + ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        manifest = {entry["title"]: entry for entry in load_manifest(shard_dir)}
+        used_filenames = {entry["file"] for entry in manifest.values()}
+        changed = False
+
+        titles = set()
+        for song in songs:
+            title = song["title"]
+            titles.add(title)
+            encoded = encode_song(song)
+            sha256 = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+            if loaded_hashes.get(title) == sha256:
+                continue
+
+            entry = manifest.get(title)
+            if entry is None:
+                entry = {"title": title, "file": shard_filename(title, used_filenames)}
+                manifest[title] = entry
+                used_filenames.add(entry["file"])
+            entry["sha256"] = sha256
+            if write_atomically(os.path.join(shard_dir, entry["file"]), [encoded]):
+                changed = True
+
+        for title in loaded_hashes.keys() - titles:
+            entry = manifest.pop(title, None)
+            if entry is not None:
+                try:
+                    os.remove(os.path.join(shard_dir, entry["file"]))
+                except FileNotFoundError:
+                    pass
+                changed = True
+
+        encoder = json.JSONEncoder(sort_keys=True, indent=4)
+        entries = sorted(manifest.values(), key=lambda entry: entry["title"])
+        if write_atomically(os.path.join(shard_dir, MANIFEST_FILENAME), encoder.iterencode(entries)):
+            changed = True
+
+    # The songs as saved are now the baseline for the next save.
+    if isinstance(songs, ShardedSongs):
+        songs.loaded_hashes = {title: entry["sha256"]
+                               for title, entry in manifest.items() if title in titles}
+
+    return changed
+
+# SHA-256 of a file's contents, or None if it doesn't exist.
+def file_digest(filename):
+    digest = hashlib.sha256()
+
+    try:
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+
+    return digest.hexdigest()
+
+# Write the chunks (strings, written as UTF-8, or bytes) to the file, so that a
+# crash at any point leaves either the old or the new file in place, never a
+# partial one: the chunks go to a temporary file in the same directory, which
+# is fsynced and then renamed over the original. If the new contents are
+# identical to the existing file, nothing is replaced. Returns whether the
+# file was replaced.
+def write_atomically(filename, chunks, backup=False):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=directory,
+                                        prefix=os.path.basename(filename) + ".",
+                                        suffix=".tmp")
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                f.write(chunk)
+                digest.update(chunk)
+
+            unchanged = digest.hexdigest() == file_digest(filename)
+            if not unchanged:
+                f.flush()
+                os.fsync(f.fileno())
+
+        if unchanged:
+            os.remove(tmp_filename)
+            return False
+
+        # mkstemp() creates the file readable only by us.
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_filename)
+        else:
+            os.chmod(tmp_filename, 0o644)
+
+        if backup and os.path.exists(filename):
+            # A hard link is instant; copy if the file system can't do it.
+            backup_filename = filename + ".bak"
+            if os.path.exists(backup_filename):
+                os.remove(backup_filename)
+            try:
+                os.link(filename, backup_filename)
+            except OSError:
+                shutil.copy2(filename, backup_filename)
+
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    # Make the rename itself durable. Not possible on all platforms.
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        pass
+    else:
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    return True
+
+# Find a song by title or synonym, ignoring case. If songs is None, the song
+# is looked up in the stored database instead, through the title index with
+# the SQLite backend and otherwise by streaming the songs.
 def get_song_by_title(songs, title):
+    if songs is None:
+        if STORAGE == "sqlite":
+            import db_sqlite
+            return db_sqlite.get_song_by_title(title)
+        songs = iter_songs()
+
     title = title.lower().strip()
 
     for song in songs:
@@ -25,3 +454,136 @@ def get_song_by_title(songs, title):
 
     return None
 
+# Normalize a title for matching: fold accents, smart quotes, punctuation,
+# spacing and case, so "Sgt Pepper ‘s" and "Sgt. Pepper's" compare equal.
+def normalize_title(title):
+    return NON_ALPHANUMERIC_RE.sub("", fold_to_ascii(title.lower()))
+
+# Replace accented characters with their base letter and drop any other
+# non-ASCII characters.
+def fold_to_ascii(text):
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+# Set of character trigrams of a normalized title, with markers for the
+# start and end so that short titles still have a few trigrams.
+def title_trigrams(normalized_title):
+    padded = "^^" + normalized_title + "$"
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+# Lookup table from title (and synonyms) to song. Build one after load() and
+# use it instead of get_song_by_title() when looking up many titles.
+# Songs appended to the list are picked up on the next lookup; use add_title()
+# to add a synonym to an existing song.
+#
+# get() tries the lowercased title, then the normalized title. match() ranks
+# fuzzy candidates using an inverted index of title trigrams.
+class SongIndex:
+    def __init__(self, songs):
+        self.songs = songs
+        self.indexed_count = 0
+        self._index_new_songs()
+
+    def _index_new_songs(self):
+        if self.indexed_count == 0 or self.indexed_count > len(self.songs):
+            # First build, or songs were removed: start over.
+            self.by_title = {}
+            self.by_normalized_title = {}
+            # Parallel lists, one entry per song and distinct normalized title
+            # of that song, so match() finds every song with a title, even
+            # where get() returns the first one.
+            self.normalized_titles = []
+            self.trigram_sets = []
+            self.trigram_songs = []
+            # Map from trigram to map from trigram count to list of positions
+            # in the lists above, and the set of trigram counts. match() looks
+            # at titles with each trigram count separately.
+            self.postings = {}
+            self.trigram_counts = set()
+            # (id of song, normalized title) pairs in the lists above.
+            self.indexed_pairs = set()
+            self.indexed_count = 0
+
+        for song in self.songs[self.indexed_count:]:
+            for title in [song["title"]] + song.get("other_titles", []):
+                self._index_title(song, title)
+        self.indexed_count = len(self.songs)
+
+    def _index_title(self, song, title):
+        # Keep the first song with this title, like get_song_by_title() does.
+        self.by_title.setdefault(title.lower(), song)
+
+        normalized_title = normalize_title(title)
+        self.by_normalized_title.setdefault(normalized_title, song)
+
+        if (id(song), normalized_title) not in self.indexed_pairs:
+            self.indexed_pairs.add((id(song), normalized_title))
+            position = len(self.normalized_titles)
+            trigrams = title_trigrams(normalized_title)
+            self.normalized_titles.append(normalized_title)
+            self.trigram_sets.append(trigrams)
+            self.trigram_songs.append(song)
+            self.trigram_counts.add(len(trigrams))
+            for trigram in trigrams:
+                self.postings.setdefault(trigram, {}).setdefault(len(trigrams), []).append(position)
+
+    def add(self, song):
+        self.songs.append(song)
+        self._index_new_songs()
+
+    def add_title(self, song, title):
+        song.setdefault("other_titles", []).append(title)
+        self._index_title(song, title)
+
+    def get(self, title):
+        if self.indexed_count != len(self.songs):
+            self._index_new_songs()
+
+        song = self.by_title.get(title.lower().strip())
+        if song is None:
+            song = self.by_normalized_title.get(normalize_title(title))
+
+        return song
+
+    # Ranked list of (score, song) candidates for the title, best first. The
+    # score is the Dice coefficient of the normalized titles' trigrams, so 1.0
+    # means the normalized titles are equal.
+    def match(self, title, limit=5, min_score=MIN_MATCH_SCORE):
+        if self.indexed_count != len(self.songs):
+            self._index_new_songs()
+
+        trigrams = title_trigrams(normalize_title(title))
+        count = len(trigrams)
+        postings = [self.postings.get(trigram, {}) for trigram in trigrams]
+
+        # Best score per song, since a song can match through several titles.
+        scores = {}
+        for title_count in self.trigram_counts:
+            # A title with title_count trigrams needs to share this many with
+            # the query to reach min_score. Titles too short or too long to
+            # share that many are skipped.
+            min_overlap = max(1, math.ceil(min_score * (count + title_count) / 2 - 1e-9))
+            if min_overlap > min(count, title_count):
+                continue
+
+            # Prefix filtering: a title sharing min_overlap of the query's
+            # trigrams shares at least hits of any count - min_overlap + hits
+            # of them, so only the posting lists of that many of the rarest
+            # trigrams are counted. The candidates' overlaps are then counted
+            # with set intersections, which map() runs in C.
+            hits = min(PREFIX_HITS, min_overlap)
+            lists = sorted((positions_by_count.get(title_count, ()) for positions_by_count in postings), key=len)
+            prefix_overlaps = collections.Counter()
+            for positions in lists[:count - min_overlap + hits]:
+                prefix_overlaps.update(positions)
+            candidates = [position for position, overlap in prefix_overlaps.items() if overlap >= hits]
+            overlaps = map(len, map(trigrams.intersection, map(self.trigram_sets.__getitem__, candidates)))
+
+            for position, overlap in zip(candidates, overlaps):
+                score = 2 * overlap / (count + title_count)
+                if score >= min_score:
+                    song = self.trigram_songs[position]
+                    if score > scores.get(id(song), (0, None))[0]:
+                        scores[id(song)] = (score, song)
+
+        ranked = sorted(scores.values(), key=lambda item: (-item[0], item[1]["title"]))
+        return ranked[:limit]
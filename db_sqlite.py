@@ -0,0 +1,392 @@
+
+# SQLite backend for the song database, with a table per source and indexes
+# on title, year and songwriter, so questions like "songs with chords from
+# 1965 by Lennon" can be asked in SQL:
+#
+#     SELECT songs.title FROM songs
+#         JOIN yendor ON yendor.song_id = songs.id
+#         WHERE yendor.year = 1965 AND yendor.songwriter = 'Lennon'
+#         AND EXISTS (SELECT 1 FROM chords WHERE chords.song_id = songs.id);
+#
+# beatles_songs.json stays the source of truth: export_json() writes it back
+# out from the SQLite file, byte for byte the same as db.save_json().
+#
+# Each sub-object is stored whole as JSON in a "data" column, with the fields
+# worth querying copied into their own columns. The isophonics events get a
+# row each. Anything that doesn't fit these tables is kept in songs.extra, so
+# load(save(songs)) always gives back the same songs.
+
+import sys
+import json
+import sqlite3
+import hashlib
+
+import db
+import isophonics
+
+FILENAME = "beatles_songs.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL UNIQUE,
+    -- Hash of the song's JSON, to skip unchanged songs when saving.
+    sha256 TEXT NOT NULL,
+    -- JSON object with the keys not stored in the other tables.
+    extra TEXT NOT NULL,
+    -- JSON list of the isophonics annotations stored in the columnar
+    -- encoding (see isophonics.py), to give them back that way.
+    columnar_labs TEXT NOT NULL DEFAULT '[]'
+);
+
+-- The title (position 0) and other_titles (position 1 and up).
+CREATE TABLE IF NOT EXISTS titles (
+    song_id INTEGER NOT NULL REFERENCES songs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    title_lower TEXT NOT NULL,
+    PRIMARY KEY (song_id, position)
+);
+CREATE INDEX IF NOT EXISTS titles_title_lower ON titles(title_lower);
+
+CREATE TABLE IF NOT EXISTS yendor (
+    song_id INTEGER PRIMARY KEY REFERENCES songs(id) ON DELETE CASCADE,
+    year INTEGER,
+    songwriter TEXT,
+    duration REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS yendor_year ON yendor(year);
+CREATE INDEX IF NOT EXISTS yendor_songwriter ON yendor(songwriter);
+
+-- One row per variant ("album" or "single").
+CREATE TABLE IF NOT EXISTS pannell (
+    song_id INTEGER NOT NULL REFERENCES songs(id) ON DELETE CASCADE,
+    variant TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (song_id, variant)
+);
+
+CREATE TABLE IF NOT EXISTS chadwambles (
+    song_id INTEGER PRIMARY KEY REFERENCES songs(id) ON DELETE CASCADE,
+    year INTEGER,
+    album TEXT,
+    danceability REAL,
+    energy REAL,
+    speechiness REAL,
+    acousticness REAL,
+    liveness REAL,
+    valence REAL,
+    duration_ms INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chadwambles_year ON chadwambles(year);
+
+CREATE TABLE IF NOT EXISTS wikipedia (
+    song_id INTEGER PRIMARY KEY REFERENCES songs(id) ON DELETE CASCADE,
+    url TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS TheHoleGotFixed (
+    song_id INTEGER PRIMARY KEY REFERENCES songs(id) ON DELETE CASCADE,
+    key TEXT,
+    tempo INTEGER,
+    data TEXT NOT NULL
+);
+
+-- isophonics keylab, seglab and chordlab events, in order.
+CREATE TABLE IF NOT EXISTS keys (
+    song_id INTEGER NOT NULL REFERENCES songs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    begin_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    section_type TEXT NOT NULL,
+    key TEXT,
+    PRIMARY KEY (song_id, position)
+);
+CREATE INDEX IF NOT EXISTS keys_key ON keys(key);
+
+CREATE TABLE IF NOT EXISTS segments (
+    song_id INTEGER NOT NULL REFERENCES songs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    begin_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    segment TEXT NOT NULL,
+    PRIMARY KEY (song_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS chords (
+    song_id INTEGER NOT NULL REFERENCES songs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    begin_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    chord TEXT NOT NULL,
+    PRIMARY KEY (song_id, position)
+);
+CREATE INDEX IF NOT EXISTS chords_chord ON chords(chord);
+"""
+
+# Sub-objects with a table, with the columns copied out of them.
+SOURCE_COLUMNS = {
+    "yendor": ["year", "songwriter", "duration"],
+    "chadwambles": ["year", "album", "danceability", "energy", "speechiness",
+                    "acousticness", "liveness", "valence", "duration_ms"],
+    "wikipedia": ["url"],
+    "TheHoleGotFixed": ["key", "tempo"],
+}
+
+# isophonics annotation: (table, string fields of each event, optional fields).
+LAB_TABLES = {
+    "keylab": ("keys", ["sectionType", "key"], {"key"}),
+    "seglab": ("segments", ["segment"], set()),
+    "chordlab": ("chords", ["chord"], set()),
+}
+
+# Table column for each event field.
+EVENT_COLUMNS = {
+    "beginTime": "begin_time",
+    "endTime": "end_time",
+    "sectionType": "section_type",
+    "key": "key",
+    "segment": "segment",
+    "chord": "chord",
+}
+
+def connect(filename=FILENAME):
+    connection = sqlite3.connect(filename)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+def load(filename=FILENAME):
+    return list(iter_songs(filename=filename))
+
+def iter_songs(fields=None, filename=FILENAME):
+    connection = connect(filename)
+    try:
+        song_ids = [song_id for (song_id,) in connection.execute("SELECT id FROM songs ORDER BY title")]
+        for song_id in song_ids:
+            song = load_song(connection, song_id, fields)
+            if fields is not None:
+                song = {key: song[key] for key in fields if key in song}
+            yield song
+    finally:
+        connection.close()
+
+# Look up a song by title or synonym using the index, without loading the
+# other songs. db.get_song_by_title(None, title) routes here.
+def get_song_by_title(title, filename=FILENAME):
+    connection = connect(filename)
+    try:
+        row = connection.execute("""SELECT songs.id FROM titles
+                                    JOIN songs ON songs.id = titles.song_id
+                                    WHERE titles.title_lower = ?
+                                    ORDER BY songs.title LIMIT 1""",
+                                 (title.lower().strip(),)).fetchone()
+        if row is None:
+            return None
+
+        return load_song(connection, row[0])
+    finally:
+        connection.close()
+
+# If fields is given, the tables of the other sources aren't read.
+def load_song(connection, song_id, fields=None):
+    title, extra, columnar_labs = connection.execute(
+        "SELECT title, extra, columnar_labs FROM songs WHERE id = ?", (song_id,)).fetchone()
+    song = json.loads(extra)
+    columnar_labs = json.loads(columnar_labs)
+    song["title"] = title
+
+    def wanted(key):
+        return fields is None or key in fields
+
+    other_titles = [other_title for (other_title,) in connection.execute(
+        "SELECT title FROM titles WHERE song_id = ? AND position > 0 ORDER BY position",
+        (song_id,))]
+    if other_titles:
+        song["other_titles"] = other_titles
+
+    for source in filter(wanted, SOURCE_COLUMNS):
+        row = connection.execute(f"SELECT data FROM {source} WHERE song_id = ?",
+                                 (song_id,)).fetchone()
+        if row is not None:
+            song[source] = json.loads(row[0])
+
+    if wanted("pannell"):
+        pannell = {variant: json.loads(data) for variant, data in connection.execute(
+            "SELECT variant, data FROM pannell WHERE song_id = ? ORDER BY variant", (song_id,))}
+        if pannell:
+            song["pannell"] = pannell
+
+    if not wanted("isophonics"):
+        return song
+
+    for lab, (table, event_fields, optional_fields) in LAB_TABLES.items():
+        columns = ["beginTime", "endTime"] + event_fields
+        events = []
+        for row in connection.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS[field] for field in columns)} "
+                f"FROM {table} WHERE song_id = ? ORDER BY position", (song_id,)):
+            event = dict(zip(columns, row))
+            for field in optional_fields:
+                if event[field] is None:
+                    del event[field]
+            events.append(event)
+        if events:
+            if lab in columnar_labs:
+                events = isophonics.events_to_json(lab, events)
+            song.setdefault("isophonics", {})[lab] = events
+
+    return song
+
+# Save the songs, replacing what's in the file. Only songs that changed are
+# rewritten. Returns whether anything changed.
+def save(songs, filename=FILENAME):
+    connection = connect(filename)
+    try:
+        with connection:
+            stored = {title: (song_id, sha256) for song_id, title, sha256 in
+                      connection.execute("SELECT id, title, sha256 FROM songs")}
+            changed = False
+
+            for song in songs:
+                sha256 = hashlib.sha256(db.encode_song(song).encode("utf-8")).hexdigest()
+                song_id, stored_sha256 = stored.pop(song["title"], (None, None))
+                if stored_sha256 == sha256:
+                    continue
+                if song_id is not None:
+                    connection.execute("DELETE FROM songs WHERE id = ?", (song_id,))
+                insert_song(connection, song, sha256)
+                changed = True
+
+            # Whatever is left was removed from the list.
+            for song_id, _ in stored.values():
+                connection.execute("DELETE FROM songs WHERE id = ?", (song_id,))
+                changed = True
+
+        return changed
+    finally:
+        connection.close()
+
+def insert_song(connection, song, sha256):
+    extra = dict(song)
+    title = extra.pop("title")
+    other_titles = extra.get("other_titles")
+    if isinstance(other_titles, list) and other_titles and \
+            all(isinstance(other_title, str) for other_title in other_titles):
+        del extra["other_titles"]
+    else:
+        other_titles = []
+
+    # Fill in extra last, once we know which keys the tables took.
+    cursor = connection.execute("INSERT INTO songs (title, sha256, extra) VALUES (?, ?, '{}')",
+                                (title, sha256))
+    song_id = cursor.lastrowid
+
+    for position, t in enumerate([title] + other_titles):
+        connection.execute("INSERT INTO titles (song_id, position, title, title_lower) VALUES (?, ?, ?, ?)",
+                           (song_id, position, t, t.lower()))
+
+    for source, columns in SOURCE_COLUMNS.items():
+        value = extra.get(source)
+        if isinstance(value, dict):
+            row = [source_column(source, value, column) for column in columns]
+            connection.execute(f"INSERT INTO {source} (song_id, {', '.join(columns)}, data) "
+                               f"VALUES ({', '.join('?' * (len(columns) + 2))})",
+                               [song_id] + row + [json.dumps(value, sort_keys=True)])
+            del extra[source]
+
+    pannell = extra.get("pannell")
+    if isinstance(pannell, dict) and pannell:
+        for variant, data in pannell.items():
+            connection.execute("INSERT INTO pannell (song_id, variant, data) VALUES (?, ?, ?)",
+                               (song_id, variant, json.dumps(data, sort_keys=True)))
+        del extra["pannell"]
+
+    annotations = extra.get("isophonics")
+    columnar_labs = []
+    if isinstance(annotations, dict):
+        remaining = dict(annotations)
+        for lab, (table, fields, optional_fields) in LAB_TABLES.items():
+            events = remaining.get(lab)
+            if is_columnar_annotation(lab, events):
+                events = list(isophonics.events({"isophonics": annotations}, lab))
+                columnar_labs.append(lab)
+            if is_event_list(events, fields, optional_fields):
+                columns = ["beginTime", "endTime"] + fields
+                connection.executemany(
+                    f"INSERT INTO {table} (song_id, position, "
+                    f"{', '.join(EVENT_COLUMNS[field] for field in columns)}) "
+                    f"VALUES ({', '.join('?' * (len(columns) + 2))})",
+                    [[song_id, position] + [event.get(field) for field in columns]
+                     for position, event in enumerate(events)])
+                del remaining[lab]
+            elif lab in columnar_labs:
+                columnar_labs.remove(lab)
+        if remaining or not annotations:
+            extra["isophonics"] = remaining
+        else:
+            del extra["isophonics"]
+
+    connection.execute("UPDATE songs SET extra = ?, columnar_labs = ? WHERE id = ?",
+                       (json.dumps(extra, sort_keys=True), json.dumps(columnar_labs), song_id))
+
+# Value of a column copied out of a sub-object, or None if it's missing or
+# not a plain number or string.
+def source_column(source, value, column):
+    if source == "TheHoleGotFixed" and column == "tempo":
+        tempos = value.get("tempos")
+        value = tempos[0] if isinstance(tempos, list) and tempos else None
+    else:
+        value = value.get(column)
+
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value
+
+    return None
+
+# Whether the annotation is in the columnar encoding and would come back the
+# same from its events.
+def is_columnar_annotation(lab, annotation):
+    if not isophonics.is_columnar(annotation):
+        return False
+
+    try:
+        events = list(isophonics.events({"isophonics": {lab: annotation}}, lab))
+        return isophonics.events_to_json(lab, events) == annotation
+    except (KeyError, IndexError, TypeError):
+        return False
+
+# Whether the events can be stored as table rows and read back unchanged.
+def is_event_list(events, fields, optional_fields):
+    if not isinstance(events, list) or not events:
+        return False
+
+    required = {"beginTime", "endTime"} | (set(fields) - optional_fields)
+    for event in events:
+        if not isinstance(event, dict) or not required <= event.keys() <= required | optional_fields:
+            return False
+        if not all(type(event[time]) is float for time in ("beginTime", "endTime")):
+            return False
+        if not all(isinstance(event[field], str) for field in event.keys() - {"beginTime", "endTime"}):
+            return False
+
+    return True
+
+# Write the canonical JSON file from the SQLite file.
+def export_json(filename=FILENAME, json_filename=db.FILENAME):
+    return db.save_json(load(filename), json_filename)
+
+# Fill the SQLite file from the canonical JSON file.
+def import_json(filename=FILENAME, json_filename=db.FILENAME):
+    return save(db.load_json(json_filename), filename)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["import"]:
+        import_json()
+    elif sys.argv[1:] == ["export"]:
+        export_json()
+    else:
+        print("Usage: python db_sqlite.py import|export")
@@ -0,0 +1,127 @@
+
+# Precompute per-song features derived from the isophonics annotations and
+# the TheHoleGotFixed tempos, so that main.js and analysis scripts don't each
+# recompute them from the raw events.
+#
+# The features are written to the beatles_derived.json sidecar, an object
+# keyed by song title:
+#
+#     {"Help!": {"sourceHash": "...",
+#                "distinctChords": 9,
+#                "chordChangesPerMinute": 61.3,
+#                "segmentSeconds": {"intro": 5.2, "verse": 60.1, ...},
+#                "keyChanges": 0,
+#                "tempo": {"min": 95, "max": 95, "mean": 95.0, "count": 1}}, ...}
+#
+# Each entry records a hash of the song's source sub-objects (and of
+# FEATURES_VERSION), and is only recomputed when that hash changes. Features
+# that a song has no data for are left out.
+#
+#     % python derive_features.py
+
+import json
+import hashlib
+
+import db
+import isophonics
+
+FILENAME = "beatles_derived.json"
+
+# Bump when the features change, to recompute every song.
+FEATURES_VERSION = 1
+
+# Sub-objects of a song that the features are derived from.
+SOURCES = ["isophonics", "TheHoleGotFixed"]
+
+# Chord label meaning "no chord".
+NO_CHORD = "N"
+
+def source_hash(song):
+    sources = {source: song.get(source) for source in SOURCES}
+    encoded = json.dumps([FEATURES_VERSION, sources], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+# Features of the chordlab annotation: number of distinct chords, and chord
+# changes per minute over the annotated span. "No chord" events are skipped.
+def chord_features(song):
+    events = list(isophonics.events(song, "chordlab"))
+    if not events:
+        return {}
+
+    chords = [event["chord"] for event in events if event.get("chord", NO_CHORD) != NO_CHORD]
+    changes = sum(1 for previous, chord in zip(chords, chords[1:]) if chord != previous)
+    minutes = (events[-1]["endTime"] - events[0]["beginTime"]) / 60
+
+    features = {"distinctChords": len(set(chords))}
+    if minutes > 0:
+        features["chordChangesPerMinute"] = round(changes / minutes, 3)
+    return features
+
+# Seconds spent in each segment type (verse, refrain, ...) of the seglab
+# annotation.
+def segment_features(song):
+    seconds = {}
+    for event in isophonics.events(song, "seglab"):
+        segment = event.get("segment")
+        if segment is not None:
+            segment = segment.lower()
+            seconds[segment] = seconds.get(segment, 0) + event["endTime"] - event["beginTime"]
+
+    if not seconds:
+        return {}
+    return {"segmentSeconds": {segment: round(value, 3) for segment, value in sorted(seconds.items())}}
+
+# Number of times the key changes in the keylab annotation.
+def key_features(song):
+    keys = [event["key"] for event in isophonics.events(song, "keylab") if "key" in event]
+    if not keys:
+        return {}
+    return {"keyChanges": sum(1 for previous, key in zip(keys, keys[1:]) if key != previous)}
+
+def tempo_features(song):
+    tempos = song.get("TheHoleGotFixed", {}).get("tempos")
+    if not tempos:
+        return {}
+    return {"tempo": {
+        "min": min(tempos),
+        "max": max(tempos),
+        "mean": round(sum(tempos) / len(tempos), 3),
+        "count": len(tempos),
+    }}
+
+def derive(song):
+    features = {}
+    for function in [chord_features, segment_features, key_features, tempo_features]:
+        features.update(function(song))
+    return features
+
+def load_derived(filename=FILENAME):
+    try:
+        with open(filename, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Update the sidecar file, recomputing only the songs whose sources changed.
+# Returns the number of songs recomputed.
+def main(filename=FILENAME):
+    old_derived = load_derived(filename)
+    derived = {}
+    recomputed = 0
+
+    for song in db.iter_songs(["title"] + SOURCES):
+        digest = source_hash(song)
+        entry = old_derived.get(song["title"])
+        if entry is None or entry.get("sourceHash") != digest:
+            entry = {"sourceHash": digest, **derive(song)}
+            recomputed += 1
+        derived[song["title"]] = entry
+
+    encoder = json.JSONEncoder(sort_keys=True, indent=4, ensure_ascii=False)
+    db.write_atomically(filename, encoder.iterencode(derived))
+
+    print(f"Recomputed {recomputed} of {len(derived)} songs")
+    return recomputed
+
+if __name__ == "__main__":
+    main()
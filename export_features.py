@@ -0,0 +1,154 @@
+
+# Export the numeric fields that main.js graphs into a columnar file, one row
+# per song, so analysis can load whole columns and aggregate them with
+# vectorized operations instead of walking the nested song dicts.
+#
+# Writes beatles_features.parquet if pyarrow is installed, otherwise
+# beatles_features.npz (uncompressed, one typed array per column). Missing
+# values (including the Billboard position of songs that didn't chart, -1 in
+# yendor) are null in Parquet; in the .npz file they're NaN for floats and -1
+# for integers. String columns are stored as codes into a dictionary array in
+# the .npz file, e.g. title_codes into titles. The files are written
+# atomically (see db.write_atomically()).
+#
+#     % python export_features.py
+#
+#     >>> features = numpy.load("beatles_features.npz")
+#     >>> energy, year = features["energy"], features["year"]
+#     >>> energy[year == 1965].mean()
+
+import io
+
+# pip install numpy (or pyarrow)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import db
+
+BASENAME = "beatles_features"
+
+# Top-level keys needed to fill the columns.
+FIELDS = ["title", "yendor", "chadwambles", "pannell", "TheHoleGotFixed"]
+
+# Return the value at the path of keys in nested dicts, or None.
+def get_path(song, *keys):
+    value = song
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+
+    return value
+
+# None for songs that didn't chart, like build_stats.py.
+def top_50_billboard(song):
+    value = get_path(song, "yendor", "top.50.billboard")
+    return None if value == -1 else value
+
+def first_tempo(song):
+    tempos = get_path(song, "TheHoleGotFixed", "tempos")
+    return tempos[0] if tempos else None
+
+# (column name, type, function of song). Types are "str", "int" or "float";
+# floats are stored as float32, except the ones in FLOAT64_COLUMNS.
+COLUMNS = [
+    ("title", "str", lambda song: song["title"]),
+    ("year", "int", lambda song: get_path(song, "yendor", "year")),
+    ("songwriter", "str", lambda song: get_path(song, "yendor", "songwriter")),
+    ("duration", "float", lambda song: get_path(song, "yendor", "duration")),
+    ("top_50_billboard", "float", top_50_billboard),
+    ("takes", "int", lambda song: get_path(song, "pannell", "album", "Takes")),
+    ("original_songs", "float", lambda song: get_path(song, "pannell", "album", "Original_songs")),
+    ("composer_share_john", "float", lambda song: get_path(song, "pannell", "album", "Composer_share_John")),
+    ("composer_share_paul", "float", lambda song: get_path(song, "pannell", "album", "Composer_share_Paul")),
+    ("danceability", "float", lambda song: get_path(song, "chadwambles", "danceability")),
+    ("energy", "float", lambda song: get_path(song, "chadwambles", "energy")),
+    ("speechiness", "float", lambda song: get_path(song, "chadwambles", "speechiness")),
+    ("acousticness", "float", lambda song: get_path(song, "chadwambles", "acousticness")),
+    ("liveness", "float", lambda song: get_path(song, "chadwambles", "liveness")),
+    ("valence", "float", lambda song: get_path(song, "chadwambles", "valence")),
+    ("tempo", "float", first_tempo),
+]
+
+# Columns whose values need more precision than float32.
+FLOAT64_COLUMNS = {"duration"}
+
+# Map from column name to list of values, None where missing.
+def collect_columns():
+    columns = {name: [] for name, _, _ in COLUMNS}
+
+    for song in db.iter_songs(FIELDS):
+        for name, kind, get_value in COLUMNS:
+            value = get_value(song)
+            # Keep only values of the right type (e.g. no "" or "?" strings).
+            if kind == "str" and not isinstance(value, str):
+                value = None
+            elif kind != "str" and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+                value = None
+            elif kind == "int" and isinstance(value, float):
+                # Spreadsheet cells can give 3.0 for 3.
+                value = int(value) if value.is_integer() else None
+            columns[name].append(value)
+
+    return columns
+
+def write_parquet(columns, filename):
+    arrays = {}
+    for name, kind, _ in COLUMNS:
+        if kind == "str":
+            arrays[name] = pyarrow.array(columns[name], pyarrow.string()).dictionary_encode()
+        elif kind == "int":
+            arrays[name] = pyarrow.array(columns[name], pyarrow.int32())
+        elif name in FLOAT64_COLUMNS:
+            arrays[name] = pyarrow.array(columns[name], pyarrow.float64())
+        else:
+            arrays[name] = pyarrow.array(columns[name], pyarrow.float32())
+
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.table(arrays), buffer)
+    db.write_atomically(filename, [buffer.getvalue()])
+
+def write_npz(columns, filename):
+    arrays = {}
+    for name, kind, _ in COLUMNS:
+        values = columns[name]
+        if kind == "str":
+            dictionary = sorted(set(value for value in values if value is not None))
+            codes = {value: code for code, value in enumerate(dictionary)}
+            arrays[name + "s"] = np.array(dictionary, dtype=str)
+            arrays[name + "_codes"] = np.array([codes.get(value, -1) for value in values], dtype=np.int32)
+        elif kind == "int":
+            arrays[name] = np.array([-1 if value is None else value for value in values], dtype=np.int32)
+        else:
+            dtype = np.float64 if name in FLOAT64_COLUMNS else np.float32
+            arrays[name] = np.array([np.nan if value is None else value for value in values], dtype=dtype)
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    db.write_atomically(filename, [buffer.getvalue()])
+
+def main():
+    columns = collect_columns()
+
+    if pyarrow is not None:
+        filename = BASENAME + ".parquet"
+        write_parquet(columns, filename)
+    elif np is not None:
+        filename = BASENAME + ".npz"
+        write_npz(columns, filename)
+    else:
+        print("Install pyarrow or numpy to export features.")
+        return
+
+    print(f"Wrote {len(columns['title'])} songs to {filename}")
+
+if __name__ == "__main__":
+    main()
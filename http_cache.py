@@ -0,0 +1,129 @@
+
+# Persistent cache of HTTP responses, so that repeated runs don't download
+# the same pages again.
+#
+# Responses are keyed by URL and stored zlib-compressed in an SQLite file,
+# along with their ETag and Last-Modified validators. An entry younger than
+# the TTL is used as is; an older one should be revalidated with a
+# conditional GET (see conditional_headers()). When the bodies add up to more
+# than the maximum size, the least recently used entries are evicted.
+
+import json
+import time
+import zlib
+import sqlite3
+
+FILENAME = "http_cache.sqlite"
+
+# Default time to live of an entry, in seconds.
+DEFAULT_TTL = 7*24*60*60
+
+# Default maximum total size of the compressed bodies, in bytes.
+DEFAULT_MAX_SIZE = 200*1024*1024
+
+# Response headers kept with the body.
+KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    -- JSON object of the KEPT_HEADERS that the response had.
+    headers TEXT NOT NULL,
+    -- zlib-compressed body.
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses(accessed_at);
+"""
+
+class CachedResponse:
+    def __init__(self, url, status, headers, body, fetched_at):
+        self.url = url
+        self.status = status
+        # Dict of the KEPT_HEADERS the response had.
+        self.headers = headers
+        self.body = body
+        self.fetched_at = fetched_at
+
+class HTTPCache:
+    def __init__(self, filename=FILENAME, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+
+    def get(self, url):
+        """The CachedResponse for the URL, fresh or not, or None"""
+        row = self.connection.execute(
+            "SELECT status, headers, body, fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+
+        status, headers, body, fetched_at = row
+        with self.connection:
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?",
+                                    (time.time(), url))
+
+        return CachedResponse(url, status, json.loads(headers), zlib.decompress(body), fetched_at)
+
+    def is_fresh(self, response):
+        return time.time() - response.fetched_at < self.ttl
+
+    def conditional_headers(self, response):
+        """Request headers to revalidate the cached response"""
+        headers = {}
+        if "ETag" in response.headers:
+            headers["If-None-Match"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            headers["If-Modified-Since"] = response.headers["Last-Modified"]
+        return headers
+
+    def put(self, url, status, headers, body):
+        """Store a response. headers can be any mapping of response headers.
+        Returns the CachedResponse."""
+        kept_headers = {name: headers[name] for name in KEPT_HEADERS if name in headers}
+        compressed = zlib.compress(body)
+        now = time.time()
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, status, json.dumps(kept_headers), compressed, len(compressed), now, now))
+        self.evict()
+
+        return CachedResponse(url, status, kept_headers, body, now)
+
+    def refresh(self, response, headers=None):
+        """Mark a cached response as fresh, after the server answered 304 Not
+        Modified. headers are the 304's headers, which may update the
+        validators."""
+        if headers is not None:
+            for name in ["ETag", "Last-Modified"]:
+                if name in headers:
+                    response.headers[name] = headers[name]
+        response.fetched_at = time.time()
+
+        with self.connection:
+            self.connection.execute(
+                "UPDATE responses SET headers = ?, fetched_at = ? WHERE url = ?",
+                (json.dumps(response.headers), response.fetched_at, response.url))
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_size"""
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        with self.connection:
+            for url, size in self.connection.execute(
+                    "SELECT url, size FROM responses ORDER BY accessed_at").fetchall():
+                self.connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+                total_size -= size
+                if total_size <= self.max_size:
+                    break
+
+    def close(self):
+        self.connection.close()
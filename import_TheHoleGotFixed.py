@@ -3,37 +3,53 @@
 # https://www.beatlesbible.com/forum/recording-and-musicology/keys-that-the-beatles-used-now-that-youve-found-another-key/
 # The name comes from the username of that post.
 
-import db
+import import_all
+import source_state
+import tabular
+
+SOURCE = "TheHoleGotFixed"
+
+FILENAME = "TheHoleGotFixed.tsv"
+
+# Tempos are one or more BPMs separated by slashes, e.g. "120/132".
+def parse_tempos(tempos):
+    return [int(tempo) for tempo in tempos.split("/")]
+
+# (key, column, type) of the columns (see tabular.py).
+COLUMNS = [
+    ("title", "Song", "str"),
+    ("tempos", "Tempo", parse_tempos),
+    ("key", "Key", "str"),
+]
+
+# Read the file's COLUMNS, or return None if it hasn't changed since the state
+# was recorded (see source_state.py). Doesn't touch the database.
+def fetch(state=None):
+    if state is not None and not source_state.file_changed(state, FILENAME):
+        return None
+
+    return tabular.read(FILENAME, COLUMNS)
+
+def apply(songs, index, table=None):
+    if table is None:
+        table = fetch()
+
+    titles = table["title"]
+    matched_songs = tabular.match_titles(index, titles)
+    tabular.print_unmatched(tabular.unmatched_rows(titles, matched_songs), FILENAME)
+
+    for song, tempos, key in zip(matched_songs, table["tempos"], table["key"]):
+        if song is not None:
+            if "TheHoleGotFixed" not in song:
+                song["TheHoleGotFixed"] = {}
+            song["TheHoleGotFixed"]["tempos"] = tempos
+            song["TheHoleGotFixed"]["key"] = key
+            if "tempo" in song["TheHoleGotFixed"]:
+                del song["TheHoleGotFixed"]["tempo"]
 
 def main():
-    songs = db.load()
-
-    with open("TheHoleGotFixed.tsv") as f:
-        for line_number, line in enumerate(f.readlines()):
-            if line_number == 0:
-                # Skip header.
-                pass
-            else:
-                line = line.rstrip()
-                title, tempos, key = line.split("\t")
-                title = title.replace("’", "'") \
-                        .replace(" ‘", "'") \
-                        .replace(" !", "!") \
-                        .replace(" ?", "?") \
-                        .replace("inPepperland", "in Pepperland")
-                song = db.get_song_by_title(songs, title)
-                if song is None:
-                    print(f"Can't find song \"{title}\".")
-                else:
-                    tempos = [int(tempo) for tempo in tempos.split("/")]
-                    if "TheHoleGotFixed" not in song:
-                        song["TheHoleGotFixed"] = {}
-                    song["TheHoleGotFixed"]["tempos"] = tempos
-                    song["TheHoleGotFixed"]["key"] = key
-                    if "tempo" in song["TheHoleGotFixed"]:
-                        del song["TheHoleGotFixed"]["tempo"]
-
-    db.save(songs)
-
-main()
+    import_all.main([SOURCE])
+
+if __name__ == "__main__":
+    main()
 
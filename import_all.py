@@ -0,0 +1,122 @@
+
+# Import all the sources with a single load and save of the database, instead
+# of running each import_*.py script (which each load and save it).
+#
+#     % python import_all.py [--force] [SOURCE ...]
+#
+# SOURCE is e.g. "yendor" or "import_yendor"; the default is all of SOURCES.
+#
+# Each source module has:
+#
+# - SOURCE: its name in the state file (see source_state.py).
+# - fetch(state): downloads or parses the source's input without touching the
+#   database, returning None if the input isn't available or hasn't changed
+#   since the state was recorded. The fetches of all sources run at the same
+#   time. If none of them returns anything, the database isn't even loaded.
+#   A fetch that raises is reported, and the other sources are still
+#   imported.
+# - apply(songs, index, data): stores the fetched data in the songs, using
+#   the db.SongIndex of the songs. These run one at a time, in SOURCES order.
+#
+# With --force, the sources are imported even if their inputs haven't
+# changed, e.g. after changing an importer. Sources are also imported again
+# when the database changed since they were (see source_state.py).
+#
+# The lyrics aren't in the database, so import_lyrics.py isn't a source.
+
+import argparse
+import importlib
+import concurrent.futures
+
+import db
+import source_state
+
+# In the order their data is applied. yendor comes first, since it adds the
+# songs that the others look up.
+SOURCES = [
+    "import_yendor",
+    "import_wikipedia",
+    "import_chadwambles",
+    "import_TheHoleGotFixed",
+    "import_pannell",
+    "import_isophonics",
+]
+
+# Returns whether the database was written.
+def main(names=SOURCES, force=False):
+    names = [name if name.startswith("import_") else "import_" + name for name in names]
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown sources: {', '.join(unknown)}")
+    modules = [importlib.import_module(name) for name in SOURCES if name in names]
+    sources = {module.SOURCE for module in modules}
+
+    all_states = source_state.load_all()
+    database_state = all_states.get(source_state.DATABASE, {})
+    database_digest = source_state.database_digest(database_state)
+
+    # A source whose state was recorded against another database is imported
+    # from scratch (see source_state.py).
+    states = {}
+    for module in modules:
+        state = all_states.get(module.SOURCE, {})
+        if force or state.get("database") != database_digest:
+            state = {}
+        states[module.SOURCE] = state
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(modules)) as executor:
+        futures = [executor.submit(module.fetch, states[module.SOURCE]) for module in modules]
+        fetched = []
+        for module, future in zip(modules, futures):
+            try:
+                fetched.append((module, future.result()))
+            except Exception as e:
+                # Import the other sources anyway. The failed source's state
+                # isn't saved, so it's fetched again next time.
+                print(f"Fetching {module.__name__} failed: {e!r}")
+                del states[module.SOURCE]
+
+    songs = None
+    applied = set()
+    for module, data in fetched:
+        if data is None:
+            print(f"Skipping {module.__name__}: unchanged or unavailable")
+            continue
+
+        if songs is None:
+            songs = db.load()
+            index = db.SongIndex(songs)
+            titles_digest = source_state.titles_digest(songs)
+        print(f"Applying {module.__name__}")
+        module.apply(songs, index, data)
+        applied.add(module.SOURCE)
+
+    saved = songs is not None and db.save(songs)
+    titles_changed = songs is not None and source_state.titles_digest(songs) != titles_digest
+
+    # Record which database each source is now imported into. A source that
+    # wasn't applied is up to date with the new database unless songs or
+    # titles were added, which its rows could match; then it's left
+    # recorded against the old one, so that it's imported next time. That
+    # includes sources that weren't part of this run, but not ones whose
+    # fetch failed.
+    new_database_digest = source_state.database_digest(database_state)
+    other_states = {source: state for source, state in all_states.items()
+                    if source != source_state.DATABASE and source not in sources}
+    for source, state in list(states.items()) + list(other_states.items()):
+        if source in applied or (state.get("database") == database_digest and not titles_changed):
+            state["database"] = new_database_digest
+            states[source] = state
+    states[source_state.DATABASE] = database_state
+
+    # Also records the new modification times of files that were only touched.
+    source_state.save(states)
+    return saved
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import sources into the database.")
+    parser.add_argument("sources", nargs="*", default=SOURCES, metavar="SOURCE")
+    parser.add_argument("--force", action="store_true",
+                        help="import sources even if their inputs haven't changed")
+    args = parser.parse_args()
+    main(args.sources, args.force)
@@ -1,33 +1,49 @@
 
-import csv
-import db
+import import_all
+import source_state
+import tabular
+
+SOURCE = "chadwambles"
 
 FILENAME = "TheBeatlesCleaned.csv"
 
+# (key, column, type) of the columns we keep. The file also has an id column.
+COLUMNS = [
+    ("year", "year", "int"),
+    ("album", "album", "str"),
+    ("song", "song", "str"),
+    ("danceability", "danceability", "float"),
+    ("energy", "energy", "float"),
+    ("speechiness", "speechiness", "float"),
+    ("acousticness", "acousticness", "float"),
+    ("liveness", "liveness", "float"),
+    ("valence", "valence", "float"),
+    ("duration_ms", "duration_ms", "int"),
+]
+
+# Read the CSV file's COLUMNS (see tabular.py), or return None if it hasn't
+# changed since the state was recorded (see source_state.py). Doesn't touch
+# the database.
+def fetch(state=None):
+    if state is not None and not source_state.file_changed(state, FILENAME):
+        return None
+
+    return tabular.read(FILENAME, COLUMNS)
+
+def apply(songs, index, table=None):
+    if table is None:
+        table = fetch()
+
+    titles = table["song"]
+    matched_songs = tabular.match_titles(index, titles)
+    tabular.print_unmatched(tabular.unmatched_rows(titles, matched_songs), FILENAME)
+
+    for row, song in enumerate(matched_songs):
+        if song is not None:
+            song["chadwambles"] = {key: table[key][row] for key, _, _ in COLUMNS}
+
 def main():
-    songs = db.load()
-
-    with open(FILENAME) as f:
-        for row in csv.DictReader(f):
-            # Keys are: id,year,album,song,danceability,energy,speechiness,acousticness,liveness,valence,duration_ms
-            title = row["song"]
-            song = db.get_song_by_title(songs, title)
-            if song is None:
-                print(f"Can't find song \"{title}\"")
-            else:
-                song["chadwambles"] = {
-                    "year": int(row["year"]),
-                    "album": row["album"],
-                    "song": row["song"],
-                    "danceability": float(row["danceability"]),
-                    "energy": float(row["energy"]),
-                    "speechiness": float(row["speechiness"]),
-                    "acousticness": float(row["acousticness"]),
-                    "liveness": float(row["liveness"]),
-                    "valence": float(row["valence"]),
-                    "duration_ms": int(row["duration_ms"]),
-                }
-
-    db.save(songs)
-
-main()
+    import_all.main([SOURCE])
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,82 @@
 
 import os
 import pathlib
-import db
+import functools
+import multiprocessing
+import concurrent.futures
+import isophonics
+import import_all
+import source_state
+
+SOURCE = "isophonics"
 
 URL_NAME = "The%20Beatles%20Annotations.tar.gz"
 URL = "http://isophonics.net/files/annotations/" + URL_NAME
 DIR = "The_Beatles_Annotations"
 
+# Store the annotations in the compact columnar encoding (see isophonics.py)
+# rather than as one dict per event.
+COLUMNAR = True
+
+# Number of processes parsing .lab files, or None for one per CPU.
+WORKERS = None
+
+# How the worker processes are started. fetch() runs in a thread of
+# import_all.py while other threads download and parse, and forking a
+# process with threads running can deadlock, so they're started fresh.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
 # Convert a pathname to a song title.
 def pathname_to_title(pathname):
     title = pathlib.Path(pathname).stem
     title = title.split("_-_")[-1].replace("_", " ")
     return title
 
-# Get all pathnames starting at root_dir with the given extension.
-def get_pathnames(root_dir, extension):
-    files = []
+# Find the .lab files of all annotation types in one walk of the tree. Returns
+# a map from the file's path within its annotation type's directory (without
+# extension), which is the same for all annotation types of a song, to a map
+# from annotation type to pathname.
+def get_lab_pathnames(root_dir):
+    lab_pathnames = {}
 
     for dirpath, dirnames, filenames in os.walk(root_dir):
-        files.extend(os.path.join(dirpath, filename)
-                     for filename in filenames
-                     if filename.endswith(extension))
-
-    return files
-
-# Array of (song, lines) tuples.
-def get_song_lines(songs, subdir):
-    song_lines = []
-
-    pathnames = get_pathnames(DIR + "/" + subdir, ".lab")
-    for pathname in pathnames:
-        title = pathname_to_title(pathname)
-        song = db.get_song_by_title(songs, title)
-        if song is None:
-            print(f"Can't find song \"{title}\" ({pathname})")
-        else:
-            with open(pathname) as f:
-                lines = f.read().strip().split("\n")
-                song_lines.append( (song, lines) )
-
-    return song_lines
-
-def main():
+        for filename in filenames:
+            if filename.endswith(".lab"):
+                pathname = os.path.join(dirpath, filename)
+                lab_type, _, song_path = os.path.relpath(pathname, root_dir).partition(os.sep)
+                if lab_type in isophonics.LAB_TYPES:
+                    song_key = os.path.splitext(song_path)[0]
+                    lab_pathnames.setdefault(song_key, {})[lab_type] = pathname
+
+    return lab_pathnames
+
+# Read and parse a song's .lab files, given a map from annotation type to
+# pathname. Returns a map from annotation type to annotation. Runs in a
+# worker process, which doesn't see changes to the module's globals, so the
+# encoding is passed in.
+def parse_song_labs(pathnames, columnar=COLUMNAR):
+    annotations = {}
+
+    for lab_type, pathname in pathnames.items():
+        with open(pathname) as f:
+            annotations[lab_type] = parse_lab(lab_type, f.read(), pathname, columnar)
+
+    return annotations
+
+# Parse a .lab file in the columnar encoding or as a list of events.
+def parse_lab(lab_type, text, pathname, columnar=COLUMNAR):
+    if columnar:
+        return isophonics.parse_columns(lab_type, text, pathname)
+
+    return isophonics.parse_events(lab_type, text, pathname)
+
+# Parse the .lab files of the songs. Returns a list of (map from annotation
+# type to pathname, map from annotation type to annotation), or None if the
+# annotations haven't been downloaded. Given the state recorded at the last
+# import (see source_state.py), only parses the songs that have a new or
+# changed file, and returns None if there are none. Doesn't touch the
+# database.
+def fetch(state=None, workers=WORKERS):
     if not os.path.isdir(DIR):
         print()
         print("Download the following file:")
@@ -56,61 +91,64 @@ def main():
         print()
         print("Then run this script again.")
         print()
-        return
-
-    songs = db.load()
-
-    # Get the key songs are in.
-    for song, lines in get_song_lines(songs, "keylab"):
-        infos = []
-        for line in lines:
-            fields = line.split("\t")
-            info = {
-                    "beginTime": float(fields[0]),
-                    "endTime": float(fields[1]),
-                    "sectionType": fields[2],
-            }
-            if fields[2] == "Key":
-                info["key"] = fields[3]
-            infos.append(info)
-        if "isophonics" not in song:
-            song["isophonics"] = {}
-        song["isophonics"]["keylab"] = infos
-
-    # Get the segments of the songs.
-    for song, lines in get_song_lines(songs, "seglab"):
-        infos = []
-        for line in lines:
-            fields = line.split("\t", 3)
-            if len(fields) != 4:
-                print("seg doesn't have 4 fields", song["title"], fields)
-            info = {
-                    "beginTime": float(fields[0]),
-                    "endTime": float(fields[1]),
-                    "segment": fields[3],
-            }
-            infos.append(info)
-        if "isophonics" not in song:
-            song["isophonics"] = {}
-        song["isophonics"]["seglab"] = infos
-
-    # Get the song chords.
-    for song, lines in get_song_lines(songs, "chordlab"):
-        infos = []
-        for line in lines:
-            fields = line.split(" ")
-            if len(fields) != 3:
-                print("chord doesn't have 3 fields", fields)
-            info = {
-                    "beginTime": float(fields[0]),
-                    "endTime": float(fields[1]),
-                    "chord": fields[2],
-            }
-            infos.append(info)
-        if "isophonics" not in song:
-            song["isophonics"] = {}
-        song["isophonics"]["chordlab"] = infos
-
-    db.save(songs)
-
-main()
+        return None
+
+    all_pathnames = [pathnames for _, pathnames in sorted(get_lab_pathnames(DIR).items())]
+
+    if state is not None:
+        # Parsing to the other encoding changes every annotation.
+        if state.get("columnar") != COLUMNAR:
+            state.clear()
+            state["columnar"] = COLUMNAR
+
+        # Check every file, to record its fingerprint, and forget removed ones.
+        changed_pathnames = []
+        for pathnames in all_pathnames:
+            changed = [source_state.file_changed(state, pathname) for pathname in pathnames.values()]
+            if any(changed):
+                changed_pathnames.append(pathnames)
+        current = {pathname for pathnames in all_pathnames for pathname in pathnames.values()}
+        state["files"] = {pathname: fingerprint for pathname, fingerprint in state.get("files", {}).items()
+                          if pathname in current}
+
+        if not changed_pathnames:
+            return None
+        all_pathnames = changed_pathnames
+
+    # Parse the files, one song per task.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parse = functools.partial(parse_song_labs, columnar=COLUMNAR)
+    if workers == 1:
+        all_annotations = list(map(parse, all_pathnames))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context(START_METHOD)) as executor:
+            chunksize = max(1, len(all_pathnames) // (workers*4))
+            all_annotations = list(executor.map(parse, all_pathnames, chunksize=chunksize))
+
+    return list(zip(all_pathnames, all_annotations))
+
+def apply(songs, index, parsed=None):
+    if parsed is None:
+        parsed = fetch()
+        if parsed is None:
+            return
+
+    # Store the keys, segments and chords of the songs.
+    for pathnames, annotations in parsed:
+        for lab_type, pathname in sorted(pathnames.items()):
+            title = pathname_to_title(pathname)
+            song = index.get(title)
+            if song is None:
+                print(f"Can't find song \"{title}\" ({pathname})")
+            else:
+                if "isophonics" not in song:
+                    song["isophonics"] = {}
+                song["isophonics"][lab_type] = annotations[lab_type]
+
+def main():
+    import_all.main([SOURCE])
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,195 @@
+import os
 import time
 import asyncio
 import aiohttp
+import contextlib
 import json
 import re
 import html
+import codecs
 import unicodedata
 import string
 import shutil
-import chardet
 from bs4 import BeautifulSoup
 from typing import Optional
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
 from unidecode import unidecode
 
+import db
+import http_cache
+
+# BeautifulSoup tree builder for beatleslyrics.org pages. "lxml" (pip install
+# lxml) parses several times faster, but it repairs malformed tables
+# differently, and the table and span positions _process_lyrics_page() relies
+# on (e.g. for "Wild Honey Pie") were found with html.parser. Check that the
+# extracted lyrics don't change before switching.
+HTML_PARSER = "html.parser"
+
+try:
+    # pip install charset-normalizer (faster than chardet)
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+    # pip install chardet (needed without charset-normalizer)
+    import chardet
+
+# Requests per second allowed to each host, and how many may be sent in a
+# burst. Hosts not listed get DEFAULT_RATE_LIMIT.
+DEFAULT_RATE_LIMIT = (5, 1)
+RATE_LIMITS = {}
+
+# How many songs are fetched at the same time.
+SONGS_IN_FLIGHT = 8
+
+LYRICS_FILENAME = 'lyrics.json'
+
+# Append-only log of per-song results (one JSON object per line) not yet
+# merged into lyrics.json.
+JOURNAL_FILENAME = 'lyrics.journal.jsonl'
+
+# Seconds between merges of the journal into lyrics.json.
+COMPACT_INTERVAL = 60
+
+# Cache of HTTP responses shared by the APIs (see http_cache.py). Set
+# HTTP_CACHE_FILENAME to None to always use the network.
+HTTP_CACHE_FILENAME = http_cache.FILENAME
+HTTP_CACHE_TTL = http_cache.DEFAULT_TTL
+HTTP_CACHE_MAX_SIZE = http_cache.DEFAULT_MAX_SIZE
+
+# Pages that declare no encoding have it guessed from this many bytes of the
+# body; <meta charset> is looked for in the first META_CHARSET_SCAN_SIZE.
+DETECT_SAMPLE_SIZE = 32*1024
+META_CHARSET_SCAN_SIZE = 4096
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+
+class TokenBucket:
+    """Rate limiter allowing `rate` acquisitions per second on average, in
+    bursts of up to `burst`"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        # Waiters queue on the lock, so they're served in order.
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Map from host to its TokenBucket, shared by all APIs.
+host_buckets = {}
+
+async def wait_for_host(url):
+    """Wait until the rate limit of the URL's host allows another request"""
+    host = urlsplit(url).netloc
+    bucket = host_buckets.get(host)
+    if bucket is None:
+        bucket = TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+        host_buckets[host] = bucket
+    await bucket.acquire()
+
+class HTTPResponse:
+    """The parts of an aiohttp response that the APIs use, for a response
+    whose body has been read already"""
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def charset(self):
+        content_type = self.headers.get('Content-Type', '')
+        match = re.search(r'charset=["\']?([\w.:-]+)', content_type, re.IGNORECASE)
+        return match.group(1) if match else None
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode(self.charset or 'utf-8', errors='replace')
+
+    async def json(self):
+        return json.loads(await self.text())
+
 class LyricsAPI:
-    def __init__(self, name):
+    # Maximum number of this API's requests in flight at the same time.
+    max_in_flight = 2
+
+    def __init__(self, name, base_url, cache=None):
         self.name = name
+        # Overridable, e.g. to point at a local stub server.
+        self.base_url = base_url
+        # http_cache.HTTPCache, or None to always use the network.
+        self.cache = cache
+        # Created on first use, inside the running event loop.
+        self.in_flight = None
 
     async def fetch_lyrics(self, session, title, options=None):
         raise NotImplementedError
 
+    @contextlib.asynccontextmanager
+    async def _get(self, session, url, headers=None, **kwargs):
+        """session.get() through the cache, within this API's in-flight limit
+        and the host's rate limit. Yields an HTTPResponse."""
+        cached = self.cache.get(url) if self.cache is not None else None
+
+        if cached is not None and self.cache.is_fresh(cached):
+            result = cached
+        else:
+            headers = dict(headers or {})
+            if cached is not None:
+                headers.update(self.cache.conditional_headers(cached))
+
+            if self.in_flight is None:
+                self.in_flight = asyncio.Semaphore(self.max_in_flight)
+
+            # The body is read while holding an in-flight slot, and the slot is
+            # released before yielding: callers nest _get() calls (lyrics.ovh's
+            # fallback URL, ChartLyrics' GetLyric after the search), and an
+            # outer request holding its slot while waiting for an inner one
+            # deadlocks once every slot is taken that way.
+            async with self.in_flight:
+                await wait_for_host(url)
+                async with session.get(url, headers=headers, **kwargs) as response:
+                    body = await response.read()
+
+                    if response.status == 304 and cached is not None:
+                        self.cache.refresh(cached, response.headers)
+                        result = cached
+                    elif response.status == 200 and self.cache is not None:
+                        result = self.cache.put(url, response.status, response.headers, body)
+                    else:
+                        result = http_cache.CachedResponse(url, response.status, response.headers,
+                                                           body, time.time())
+
+        yield HTTPResponse(result.status, result.headers, result.body)
+
 class LyricsOvhAPI(LyricsAPI):
-    def __init__(self):
-        super().__init__("lyrics.ovh")
+    def __init__(self, base_url="https://api.lyrics.ovh/v1/"):
+        super().__init__("lyrics.ovh", base_url)
 
     async def fetch_lyrics(self, session, title, options=None):
         # First attempt with "The Beatles"
-        url = f"https://api.lyrics.ovh/v1/The Beatles/{quote(title)}"
+        url = f"{self.base_url}The Beatles/{quote(title)}"
         try:
-            async with session.get(url) as response:
+            async with self._get(session, url) as response:
                 if response.status == 200:
                     json_response = await response.json()
                     return {'status': 'success', 'lyrics': json_response['lyrics']}
                 else:
                     # If first attempt fails, try with "Beatles"
-                    url = f"https://api.lyrics.ovh/v1/Beatles/{quote(title)}"
+                    url = f"{self.base_url}Beatles/{quote(title)}"
                     try:
-                        async with session.get(url) as response:
+                        async with self._get(session, url) as response:
                             if response.status == 200:
                                 json_response = await response.json()
                                 return {'status': 'success', 'lyrics': json_response['lyrics']}
@@ -48,14 +201,14 @@ class LyricsOvhAPI(LyricsAPI):
             return {'status': 'error', 'error': str(e)}
 
 class ChartLyricsAPI(LyricsAPI):
-    def __init__(self):
-        super().__init__("chartlyrics.com")
+    def __init__(self, base_url="http://api.chartlyrics.com/apiv1.asmx/"):
+        super().__init__("chartlyrics.com", base_url)
 
     async def fetch_lyrics(self, session, title, options=None):
         # First, search for the song
-        search_url = f"http://api.chartlyrics.com/apiv1.asmx/SearchLyric?artist=beatles&song={quote(title)}"
+        search_url = f"{self.base_url}SearchLyric?artist=beatles&song={quote(title)}"
         try:
-            async with session.get(search_url) as response:
+            async with self._get(session, search_url) as response:
                 if response.status != 200:
                     return {'status': 'error', 'error': f"HTTP {response.status} on search"}
                 
@@ -88,9 +241,9 @@ class ChartLyricsAPI(LyricsAPI):
                             checksum = checksum_match.group(1)
                             
                             # If we found a match with valid ID and checksum, fetch the lyrics
-                            lyrics_url = f"http://api.chartlyrics.com/apiv1.asmx/GetLyric?lyricId={lyric_id}&lyricCheckSum={checksum}"
+                            lyrics_url = f"{self.base_url}GetLyric?lyricId={lyric_id}&lyricCheckSum={checksum}"
                             
-                            async with session.get(lyrics_url) as lyrics_response:
+                            async with self._get(session, lyrics_url) as lyrics_response:
                                 if lyrics_response.status != 200:
                                     return {'status': 'error', 'error': f"HTTP {lyrics_response.status} on lyrics fetch"}
                                 
@@ -108,20 +261,27 @@ class ChartLyricsAPI(LyricsAPI):
             return {'status': 'error', 'error': str(e)}
 
 class BeatlesLyricsOrgAPI(LyricsAPI):
-    def __init__(self):
-        super().__init__("beatleslyrics.org")
-        self.base_url = "https://www.beatleslyrics.org/index_files/"
+    def __init__(self, base_url="https://www.beatleslyrics.org/index_files/"):
+        super().__init__("beatleslyrics.org", base_url)
         self.main_content = None
+        self.main_content_lock = None
+        # Map from slugified link text to link on the index page
+        self.links_by_slug = None
 
     async def fetch_lyrics(self, session, title, options=None):
         try:
-            if not self.main_content:
-                self.main_content = await self._fetch_page(session, self.base_url + "Page13763.htm")
+            # Songs are fetched concurrently; only the first fetches the index.
+            if self.main_content_lock is None:
+                self.main_content_lock = asyncio.Lock()
+            async with self.main_content_lock:
                 if not self.main_content:
-                    return {'status': 'error', 'error': 'Failed to fetch main page'}
+                    self.main_content = await self._fetch_page(session, self.base_url + "Page13763.htm")
+                    if self.main_content:
+                        self.links_by_slug = self._index_links(self._extract_links(self.main_content))
+            if not self.main_content:
+                return {'status': 'error', 'error': 'Failed to fetch main page'}
 
-            links = self._extract_links(self.main_content)
-            song_link = self._find_matching_link(links, title)
+            song_link = self._find_matching_link(self.links_by_slug, title)
             
             if not song_link:
                 return {'status': 'error', 'error': 'Song page not found'}
@@ -143,18 +303,17 @@ class BeatlesLyricsOrgAPI(LyricsAPI):
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
         }
 
-        async with session.get(url, headers=headers) as response:
+        async with self._get(session, url, headers=headers) as response:
             if response.status == 200:
                 content = await response.read()
-                detected = chardet.detect(content)
                 try:
-                    return content.decode(detected['encoding'] or 'utf-8')
+                    return content.decode(resolve_encoding(content, response.charset))
                 except UnicodeDecodeError:
                     return content.decode('utf-8', errors='ignore')
             return None
 
     def _extract_links(self, content):
-        soup = BeautifulSoup('\n'.join(content.splitlines()[1000:]), 'html.parser')
+        soup = BeautifulSoup('\n'.join(content.splitlines()[1000:]), HTML_PARSER)
         links = []
         pattern = re.compile(r'Page\d+\.htm$')
         
@@ -168,15 +327,18 @@ class BeatlesLyricsOrgAPI(LyricsAPI):
         
         return links
 
-    def _find_matching_link(self, links, title):
-        slug_title = slugify(title)
+    def _index_links(self, links):
+        links_by_slug = {}
         for link in links:
-            if slugify(link['text']) == slug_title:
-                return link
-        return None
+            # The first link with a given text wins
+            links_by_slug.setdefault(slugify(link['text']), link)
+        return links_by_slug
+
+    def _find_matching_link(self, links_by_slug, title):
+        return links_by_slug.get(slugify(title))
 
     def _process_lyrics_page(self, content, title, options=None):
-        soup = BeautifulSoup(content, 'html.parser')
+        soup = BeautifulSoup(content, HTML_PARSER)
         tables = soup.find_all('table')
         
         if not tables:
@@ -212,37 +374,53 @@ class BeatlesLyricsOrgAPI(LyricsAPI):
             and "lennon" not in writer_credit.lower() and "mccartney" not in writer_credit.lower():
                 return {'status': 'error', 'error': 'Writer credit not properly formatted'}
         
-        lyrics_content = str(last_table)
+        # Drop the title and writer credit from the tree and take the rest
         for span in spans[:spandex+2]:
-            lyrics_content = lyrics_content.replace(str(span), '')
-        
-        lyrics = BeautifulSoup(lyrics_content, 'html.parser').get_text()
+            span.decompose()
+
+        lyrics = last_table.get_text()
         lyrics = re.sub(r'<br\s*/?\s*>', '\n', lyrics, flags=re.IGNORECASE)
         lyrics = re.sub(r'<[^>]+>', '', lyrics)
         lyrics = normalize_lyrics(re.sub(r'\n\s*\n', '\n', lyrics).strip())
         
         return {'status': 'success', 'lyrics': lyrics}
 
+def known_encoding(name):
+    """The codec name for an encoding name, or None if Python doesn't know it"""
+    try:
+        return codecs.lookup(name).name if name else None
+    except LookupError:
+        return None
+
+def resolve_encoding(content, declared=None):
+    """Encoding of a page body: the one declared by the Content-Type header or
+    a <meta charset> if any, otherwise guessed from a sample of the body"""
+    encoding = known_encoding(declared)
+    if encoding:
+        return encoding
+
+    match = META_CHARSET_RE.search(content, 0, META_CHARSET_SCAN_SIZE)
+    encoding = known_encoding(match.group(1).decode('ascii')) if match else None
+    if encoding:
+        return encoding
+
+    detector = charset_normalizer if charset_normalizer is not None else chardet
+    encoding = known_encoding(detector.detect(content[:DETECT_SAMPLE_SIZE])['encoding'])
+    # A plain ASCII sample says nothing about the rest of the page
+    if encoding is None or encoding == 'ascii':
+        return 'utf-8'
+    return encoding
+
 def slugify(text):
     """Convert text to a normalized form for comparison"""
-    text = unidecode(str(text).lower())
-    text = re.sub(r'[^\w\s-]', '', text)
-    return re.sub(r'[-\s]+', '-', text).strip('-')
+    return db.normalize_title(unidecode(str(text)))
 
-def repeat_line(s):
-    # Check if string ends with " x" followed by a digit
-    match = re.search(r' x(\d)$', s)
-    
-    if match:
-        num = int(match.group(1)) # Get the digit
-        base_string = s[:-3] # Remove the " x\d" from the string
-        return [base_string] * num  # Return array with string repeated num times
-    else:
-        return [s] # Return array with string appearing once
+class LyricsNormalizer:
+    """Cleans up lyrics text line by line. All patterns and tables are built
+    once, so normalizing a song is a few passes over each line."""
 
-def is_credits_or_section_name(line):
-    # List of specific credits patterns
-    credits_patterns = [
+    # Lines that are dropped as they are
+    CREDITS = frozenset([
         "(Lennon/McCartney)",
         "(Kesler/Feathers)",
         "(Berry)",
@@ -258,89 +436,166 @@ def is_credits_or_section_name(line):
         "(Solo John Lennon)",
         "[spoken]",
         "[Past Masters/single version only:"
-    ]
+    ])
 
-    credits_patterns = [c for c in credits_patterns]
-    
-    # Section patterns using regex
-    section_patterns = [
+    # Lines matching any of these (ignoring case) are dropped
+    SECTION_PATTERNS = [
         r"\[Repetition( \d)?\]? ?:? ?(x\d)?",
         r"\[Refrain\]? ?:? ?(x\d)?",
         r"Verse \d:",
         r"Chorus(.*:)?"
     ]
-    
-    # Check if line matches any credits pattern
-    if line in credits_patterns:
-        # print(f'        omitting line "{line}"') # for debugging
-        return True
-        
-    # Check if line matches any section pattern
-    for pattern in section_patterns:
-        if re.match(f"^{pattern}$", line, re.IGNORECASE):
-            # print(f'        omitting line "{line}"') # for debugging
-            return True
-            
-    return False
 
-def normalize_lyrics(text):
-    """Sanitizes text by removing or replacing unwanted characters and normalizing whitespace."""
-    if not text:
-        return ""
+    def __init__(self):
+        self.section_re = re.compile(
+            "^(?:" + "|".join(f"(?:{pattern})" for pattern in self.SECTION_PATTERNS) + ")$",
+            re.IGNORECASE)
+        self.repeat_re = re.compile(r' x(\d)$')
+        self.blank_lines_re = re.compile(r'\n\s*\n\s*\n+')
+        self.spaces_re = re.compile(r'[ \t]+')
+        self.non_ascii_re = re.compile(r'[^\x20-\x7E‘’“”]')
+
+        self.quotes_and_dashes = str.maketrans({
+            # Smart quotes to regular quotes
+            '“': '"', '”': '"', '‘': "'", '’': "'",
+            # Emdash to comma+space (this only occurs in "You've Really Got A Hold On Me")
+            '—': ", ", '–': ", ",
+        })
+        # The control characters of ASCII, which are all the Unicode "C"
+        # categories contain in that range
+        self.ascii_controls = str.maketrans("", "", "".join(map(chr, range(0x20))) + "\x7f")
+
+    def repeat_line(self, s):
+        # Check if string ends with " x" followed by a digit
+        match = self.repeat_re.search(s)
+
+        if match:
+            num = int(match.group(1)) # Get the digit
+            base_string = s[:-3] # Remove the " x\d" from the string
+            return [base_string] * num  # Return array with string repeated num times
+        else:
+            return [s] # Return array with string appearing once
+
+    def is_credits_or_section_name(self, line):
+        return line in self.CREDITS or self.section_re.match(line) is not None
+
+    def normalize_line(self, line):
+        line = line.translate(self.quotes_and_dashes)
+        line = line.replace("&emdash;", ", ")
 
-    text = str(text) # Convert to string if not already
-    text = html.unescape(text) # Decode HTML entities
+        # Replace this mess with a quote (occurs in "Christmastime" and some others)
+        line = line.replace("&amp;quot;", '"')
 
-    # Normalize multiple newlines to maximum of two
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-    
-    # Split into lines
-    lines = text.split('\n')
+        if line.isascii():
+            # NFKD leaves ASCII alone, and once the control characters are
+            # gone everything left is printable
+            line = line.translate(self.ascii_controls)
+            if "  " in line:
+                line = self.spaces_re.sub(' ', line)
+        else:
+            line = unicodedata.normalize('NFKD', line) # Normalize unicode characters
 
-    cleaned_lines = []
-    for line in lines:
-        new_line = line
+            # Remove control characters except newline
+            line = ''.join(ch for ch in line if unicodedata.category(ch)[0] != "C")
 
-        # Replace smart quotes with regular quotes
-        new_line = new_line.replace('“', '"').replace('”', '"')
-        new_line = new_line.replace('‘', "'").replace('’', "'")
+            # Replace multiple whitespace with single space
+            line = self.spaces_re.sub(' ', line)
 
-        # Replace emdash with comma+space (this only occurs in "You've Really Got A Hold On Me")
-        new_line = new_line.replace("—", ", ").replace("–", ", ").replace("&emdash;", ", ")
+            # Remove non-ASCII characters but keep basic punctuation
+            line = self.non_ascii_re.sub('', line)
 
-        # Replace this mess with a quote (occurs in "Christmastime" and some others)
-        new_line = new_line.replace("&amp;quot;", '"')
-        
-        new_line = unicodedata.normalize('NFKD', new_line) # Normalize unicode characters
+        # Strip whitespace
+        line = line.strip()
+
+        # Idiosyncratic modifications
+        line = line.removesuffix("(fade out)")
+        line = line.removesuffix("[music continues and fades to background]")
+        line = line.replace("Get back, get back, get back...]", "Get back, get back, get back...")
+        return line.strip()
 
-        # Remove control characters except newline
-        new_line = ''.join(ch for ch in new_line if unicodedata.category(ch)[0] != "C")
+    def normalize(self, text):
+        """Sanitizes text by removing or replacing unwanted characters and normalizing whitespace."""
+        if not text:
+            return ""
 
-        # Replace multiple whitespace with single space
-        new_line = re.sub(r'[ \t]+', ' ', new_line)
-        
-        # Remove non-ASCII characters but keep basic punctuation
-        new_line = re.sub(r'[^\x20-\x7E\u2018\u2019\u201C\u201D]', '', new_line)
+        text = str(text) # Convert to string if not already
+        text = html.unescape(text) # Decode HTML entities
 
-        # Strip whitespace
-        new_line = new_line.strip()
+        # Normalize multiple newlines to maximum of two
+        text = self.blank_lines_re.sub('\n\n', text)
 
-        # Idiosyncratic modifications
-        new_line = new_line.removesuffix("(fade out)")
-        new_line = new_line.removesuffix("[music continues and fades to background]")
-        new_line = new_line.replace("Get back, get back, get back...]", "Get back, get back, get back...")
-        new_line = new_line.strip()
+        cleaned_lines = []
+        for line in text.split('\n'):
+            line = self.normalize_line(line)
+            if not self.is_credits_or_section_name(line):
+                cleaned_lines += self.repeat_line(line)
+
+        # Join the lines and renormalize line breaks to a maximum of two
+        text = "\n".join(cleaned_lines)
+        return self.blank_lines_re.sub('\n\n', text)
+
+lyrics_normalizer = LyricsNormalizer()
+
+def repeat_line(s):
+    return lyrics_normalizer.repeat_line(s)
+
+def is_credits_or_section_name(line):
+    return lyrics_normalizer.is_credits_or_section_name(line)
+
+def normalize_lyrics(text):
+    """Sanitizes text by removing or replacing unwanted characters and normalizing whitespace."""
+    return lyrics_normalizer.normalize(text)
+
+def read_journal():
+    """Return the entries in the lyrics journal, oldest first"""
+    entries = []
+    try:
+        with open(JOURNAL_FILENAME, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Partly written line from a crash
+                    pass
+    except FileNotFoundError:
+        pass
+    return entries
+
+def load_lyrics():
+    """Load lyrics.json as a dict by title, with the journal replayed on top"""
+    try:
+        with open(LYRICS_FILENAME, 'r', encoding='utf-8') as file:
+            lyrics_array = json.load(file)
+    except FileNotFoundError:
+        lyrics_array = []
 
-        if not is_credits_or_section_name(new_line):
-            cleaned_lines += repeat_line(new_line)
+    lyrics = {song['title']: song for song in lyrics_array}
+    for entry in read_journal():
+        lyrics[entry['title']] = entry
+    return lyrics
+
+def compact_lyrics(lyrics, journal=None):
+    """Write all lyrics to lyrics.json and empty the journal. The journal is
+    only emptied once lyrics.json is safely written, and replaying it again
+    is harmless, so a crash at any point loses nothing."""
+    encoder = json.JSONEncoder(indent=4, sort_keys=True, ensure_ascii=False)
+    db.write_atomically(LYRICS_FILENAME,
+                        encoder.iterencode(sorted(lyrics.values(), key=lambda x: x['title'])))
+    if journal is not None:
+        journal.truncate(0)
+    else:
+        with open(JOURNAL_FILENAME, 'w', encoding='utf-8'):
+            pass
 
-    # Join the lines and renormalize line breaks to a maximum of two
-    text = "\n".join(cleaned_lines)
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-    return text
+def replay_journal():
+    """Merge entries left in the journal by an interrupted run into lyrics.json"""
+    if read_journal():
+        print(f"Replaying {JOURNAL_FILENAME}")
+        compact_lyrics(load_lyrics())
 
 def backup_lyrics_file():
     """Backup lyrics.json if it exists and is not empty"""
+    replay_journal()
     try:
         with open('lyrics.json', 'r', encoding='utf-8') as f:
             try:
@@ -386,7 +641,6 @@ async def fetch_from_api(session, api, song_data):
                     # Add indication that this was found using an alternate name
                     alt_result['alternate_name_used'] = alt_name
                     return alt_result
-                await asyncio.sleep(0.1)  # Small delay between attempts
         
         return result
     except Exception as e:
@@ -395,7 +649,8 @@ async def fetch_from_api(session, api, song_data):
 async def main(apis: Optional[list] = None,
                limit: Optional[int] = None,
                refetch: Optional[bool] = True,
-               start_at: Optional[str] = ""):
+               start_at: Optional[str] = "",
+               songs_in_flight: Optional[int] = SONGS_IN_FLIGHT):
     # Backup existing lyrics file before starting
     backup_lyrics_file()
 
@@ -407,22 +662,21 @@ async def main(apis: Optional[list] = None,
             BeatlesLyricsOrgAPI()
         ]
 
+    # Share one response cache among the APIs that don't have their own
+    if HTTP_CACHE_FILENAME is not None:
+        cache = http_cache.HTTPCache(HTTP_CACHE_FILENAME, HTTP_CACHE_TTL, HTTP_CACHE_MAX_SIZE)
+        for api in apis:
+            if api.cache is None:
+                api.cache = cache
+
     # Add statistics tracking
     stats = {api.name: {'attempts': 0, 'successes': 0} for api in apis}
 
     # Load existing lyrics
-    try:
-        with open('lyrics.json', 'r', encoding='utf-8') as file:
-            lyrics_array = json.load(file)
-    except FileNotFoundError:
-        lyrics_array = []
+    existing_lyrics = load_lyrics()
 
-    # Load song titles
-    with open('beatles_songs.json', 'r', encoding='utf-8') as file:
-        song_titles = json.load(file)
-
-    # Create a complete lyrics array with all songs
-    existing_lyrics = {song['title']: song for song in lyrics_array}
+    # Load song titles, without the rest of the database
+    song_titles = list(db.iter_songs(['title', 'other_titles']))
 
     # Add any new songs from song_titles that aren't in existing_lyrics
     for song in song_titles:
@@ -452,73 +706,77 @@ async def main(apis: Optional[list] = None,
     # Create a mapping of titles to full song data
     song_data_map = {song['title']: song for song in song_titles}
 
-    async with aiohttp.ClientSession() as session:
-        for index, title in enumerate(songs_to_process):
-
-            # Skip all songs alphabetically prior to the "start_at" parameter
-            if start_at > title:
-                continue
-
-            current_entry = existing_lyrics[title]
-            fetching_yet = False
-            api_call_made = False
+    async def process_song(session, title):
+        """Fetch the song's missing lyrics from all APIs at once"""
+        nonlocal processed_count, last_compaction
 
-            for api in apis:
-                if api.name in current_entry and (isinstance(current_entry[api.name], str) or refetch == False):
-                    continue
+        current_entry = existing_lyrics[title]
+        apis_to_call = [api for api in apis
+                        if not (api.name in current_entry and (isinstance(current_entry[api.name], str) or refetch == False))]
+        if not apis_to_call:
+            return
 
-                if not fetching_yet:
-                    print(f"Fetching \"{title}\"")
-                    fetching_yet = True
-
-                print(f"    from {api.name}... ", end="")
-                
-                song_data = song_data_map.get(title, {'title': title})
-                result = await fetch_from_api(session, api, song_data)
+        song_data = song_data_map.get(title, {'title': title})
+        results = await asyncio.gather(*(fetch_from_api(session, api, song_data) for api in apis_to_call))
 
-                api_call_made = True
-                stats[api.name]['attempts'] += 1
+        # Print the song's results together, since songs finish in any order.
+        print(f"Fetching \"{title}\"")
+        for api, result in zip(apis_to_call, results):
+            print(f"    from {api.name}... ", end="")
+            stats[api.name]['attempts'] += 1
 
-                if result['status'] == 'success':
-                    lyrics = result['lyrics'].strip()
-                    lyrics = remove_author_credits(lyrics)
-                    lyrics = normalize_lyrics(lyrics)
+            if result['status'] == 'success':
+                lyrics = result['lyrics'].strip()
+                lyrics = remove_author_credits(lyrics)
+                lyrics = normalize_lyrics(lyrics)
 
-                    # Hack for lyrics from ChartLyrics
-                    if slugify(lyrics).endswith('instrumental') or slugify(lyrics).endswith('arranged-by-george-martin'):
-                        lyrics = ""
+                # Hack for lyrics from ChartLyrics
+                if slugify(lyrics).endswith('instrumental') or slugify(lyrics).endswith('arrangedbygeorgemartin'):
+                    lyrics = ""
 
-                    existing_lyrics[title][api.name] = lyrics
-                    stats[api.name]['successes'] += 1
+                existing_lyrics[title][api.name] = lyrics
+                stats[api.name]['successes'] += 1
 
-                    # Modified success message to include alternate name info
-                    if 'alternate_name_used' in result:
-                        print(f" success (alternate name: \"{result['alternate_name_used']}\")")
-                    else:
-                        print(" success")
+                # Modified success message to include alternate name info
+                if 'alternate_name_used' in result:
+                    print(f" success (alternate name: \"{result['alternate_name_used']}\")")
                 else:
-                    print("error: " + result['error'])
-                    existing_lyrics[title][api.name] = None
-
-                await asyncio.sleep(0.2)
-
-            if api_call_made:
-                processed_count += 1
-                
-                # Save every N songs
-                N = 1
-                if processed_count % N == 0:
-                    updated_lyrics_array = list(existing_lyrics.values())
-                    with open('lyrics.json', 'w', encoding='utf-8') as file:
-                        json.dump(sorted(updated_lyrics_array, key=lambda x: x['title']), 
-                                file, indent=4, sort_keys=True, ensure_ascii=False)
-                    # print(f"Progress saved after {processed_count} processed songs")
-
-    # Save final results
-    updated_lyrics_array = list(existing_lyrics.values())
-    with open('lyrics.json', 'w', encoding='utf-8') as file:
-        json.dump(sorted(updated_lyrics_array, key=lambda x: x['title']), 
-                 file, indent=4, sort_keys=True, ensure_ascii=False)
+                    print(" success")
+            else:
+                print("error: " + result['error'])
+                existing_lyrics[title][api.name] = None
+
+        processed_count += 1
+
+        # Save the song's results right away by appending them to the
+        # journal, and only now and then rewrite the whole lyrics.json.
+        journal.write(json.dumps(existing_lyrics[title], sort_keys=True, ensure_ascii=False) + '\n')
+        journal.flush()
+
+        if time.monotonic() - last_compaction >= COMPACT_INTERVAL:
+            compact_lyrics(existing_lyrics, journal)
+            last_compaction = time.monotonic()
+            # print(f"Progress saved after {processed_count} processed songs")
+
+    # Skip all songs alphabetically prior to the "start_at" parameter
+    songs_to_process = [title for title in songs_to_process if start_at <= title]
+
+    # Fetch several songs at a time. The per-API and per-host limits in
+    # LyricsAPI._get() set the actual pace.
+    songs_semaphore = asyncio.Semaphore(songs_in_flight)
+
+    async def process_song_when_allowed(session, title):
+        async with songs_semaphore:
+            await process_song(session, title)
+
+    last_compaction = time.monotonic()
+    with open(JOURNAL_FILENAME, 'a', encoding='utf-8') as journal:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(process_song_when_allowed(session, title) for title in songs_to_process))
+
+        # Save final results
+        compact_lyrics(existing_lyrics, journal)
+    os.remove(JOURNAL_FILENAME)
 
     # Print statistics
     if any(stat['attempts'] for _, stat in stats.items()):
@@ -1,12 +1,21 @@
 
+import os
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ElementTree
 from datetime import datetime, time
 
 # pip install openpyxl
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
 
-import db
+import import_all
+import source_state
+
+SOURCE = "pannell"
 
 FILENAME = "Beatles song database 2024-05-27.xlsx"
+SHEET = "Tracks"
 COMMENT_PREFIX = "David Pannell:\n"
 
 NOTE_TO_VARIANT = {
@@ -31,48 +40,126 @@ def split_out_variant(title):
 
     return title, variant
 
-def main():
-    songs = db.load()
-
-    wb = load_workbook(FILENAME, data_only=True)
-    sheet = wb["Tracks"]
-    header = []
-    for row_number, row in enumerate(sheet.iter_rows()):
-        pannell = {}
-        song = None
-        for col_number, cell in enumerate(row):
-            if row_number == 0:
-                header.append(cell.value)
-                key = None
-            else:
-                key = header[col_number]
-            if key == "Song_title":
-                title = cell.value
+# XML namespaces of the workbook's parts.
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+PACKAGE_RELATIONSHIPS_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+COMMENTS_TYPE_SUFFIX = "/comments"
+
+# Map from relationship id to the pathname (within the zip file) of the part
+# it points to, for the part with the given pathname.
+def read_relationships(archive, part_pathname):
+    directory, filename = posixpath.split(part_pathname)
+    rels_pathname = posixpath.join(directory, "_rels", filename + ".rels")
+    try:
+        root = ElementTree.fromstring(archive.read(rels_pathname))
+    except KeyError:
+        return {}
+
+    relationships = {}
+    for relationship in root.iter(PACKAGE_RELATIONSHIPS_NS + "Relationship"):
+        target = relationship.get("Target")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(directory, target))
+        relationships[relationship.get("Id")] = (relationship.get("Type"), target)
+
+    return relationships
+
+# Map from cell coordinate (e.g. "B2") to the text of its comment, for the
+# named sheet. Reads just the sheet's comments part, since the read-only
+# worksheet doesn't have the comments.
+def read_comments(filename, sheet_name):
+    with zipfile.ZipFile(filename) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        workbook_relationships = read_relationships(archive, "xl/workbook.xml")
+        sheet_pathname = None
+        for sheet in workbook.iter(MAIN_NS + "sheet"):
+            if sheet.get("name") == sheet_name:
+                sheet_pathname = workbook_relationships[sheet.get(RELATIONSHIP_ID)][1]
+        if sheet_pathname is None:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+
+        comments = {}
+        for relationship_type, target in read_relationships(archive, sheet_pathname).values():
+            if relationship_type.endswith(COMMENTS_TYPE_SUFFIX):
+                with archive.open(target) as f:
+                    for _, element in ElementTree.iterparse(f):
+                        if element.tag == MAIN_NS + "comment":
+                            # The text is in <t> elements, either directly or
+                            # in runs of formatted text.
+                            comments[element.get("ref")] = "".join(
+                                t.text or "" for t in element.iter(MAIN_NS + "t"))
+                            element.clear()
+
+    return comments
+
+# Read the "Tracks" sheet into a list of (title, variant, pannell sub-object),
+# one per track, or return None if the workbook isn't there or hasn't changed
+# since the state was recorded (see source_state.py). Doesn't touch the
+# database.
+def fetch(state=None):
+    if not os.path.isfile(FILENAME):
+        print(f"Put the Pannell workbook \"{FILENAME}\" in the current directory to import it.")
+        return None
+
+    if state is not None and not source_state.file_changed(state, FILENAME):
+        return None
+
+    tracks = []
+    comments = read_comments(FILENAME, SHEET)
+
+    # Stream the rows rather than loading every cell of the workbook.
+    wb = load_workbook(FILENAME, read_only=True, data_only=True)
+    try:
+        rows = wb[SHEET].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        column_letters = [get_column_letter(column_number) for column_number in range(1, len(header) + 1)]
+        for row_number, row in enumerate(rows, 2):
+            pannell = {}
+            title = None
+            for key, column_letter, value in zip(header, column_letters, row):
+                # Columns before the title aren't kept.
+                if key == "Song_title" and value is not None:
+                    title, variant = split_out_variant(value)
                 if title is not None:
-                    title, variant = split_out_variant(title)
-                    song = db.get_song_by_title(songs, title)
-                    if song is None:
-                        print(f"Didn't find song \"{title}\"")
-                    else:
-                        if "pannell" not in song:
-                            song["pannell"] = {}
-                        song["pannell"][variant] = pannell
-            if song is not None:
-                value = cell.value
-                if isinstance(value, datetime):
-                    value = value.strftime('%Y-%m-%d')
-                elif isinstance(value, time):
-                    value = value.hour * 3600 + value.minute * 60 + value.second
-                pannell[key] = value
-                if key is not None and cell.comment:
-                    if "comments" not in pannell:
-                        pannell["comments"] = {}
-                    comment = cell.comment.text
-                    if comment.startswith(COMMENT_PREFIX):
-                        comment = comment[len(COMMENT_PREFIX):]
-                    pannell["comments"][key] = comment
-
-    db.save(songs)
-
-main()
+                    if isinstance(value, datetime):
+                        value = value.strftime('%Y-%m-%d')
+                    elif isinstance(value, time):
+                        value = value.hour * 3600 + value.minute * 60 + value.second
+                    pannell[key] = value
+                    comment = comments.get(column_letter + str(row_number))
+                    if key is not None and comment:
+                        if "comments" not in pannell:
+                            pannell["comments"] = {}
+                        if comment.startswith(COMMENT_PREFIX):
+                            comment = comment[len(COMMENT_PREFIX):]
+                        pannell["comments"][key] = comment
+            if title is not None:
+                tracks.append((title, variant, pannell))
+    finally:
+        wb.close()
+
+    return tracks
+
+def apply(songs, index, tracks=None):
+    if tracks is None:
+        tracks = fetch()
+        if tracks is None:
+            return
+
+    for title, variant, pannell in tracks:
+        song = index.get(title)
+        if song is None:
+            print(f"Didn't find song \"{title}\"")
+        else:
+            if "pannell" not in song:
+                song["pannell"] = {}
+            song["pannell"][variant] = pannell
+
+def main():
+    import_all.main([SOURCE])
 
+if __name__ == "__main__":
+    main()
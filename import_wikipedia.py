@@ -1,20 +1,45 @@
 
 # Import links to Wikipedia pages about each song.
 
+import json
 import urllib.request
-import db
 import re
+import import_all
 
-URL = "https://en.wikipedia.org/w/index.php?title=List_of_songs_recorded_by_the_Beatles&action=raw"
+SOURCE = "wikipedia"
+
+PAGE_TITLE = "List_of_songs_recorded_by_the_Beatles"
+URL = "https://en.wikipedia.org/w/index.php?title=" + PAGE_TITLE + "&action=raw"
+REVISION_URL = ("https://en.wikipedia.org/w/api.php?action=query&prop=revisions&rvprop=ids&format=json&titles="
+                + PAGE_TITLE)
 URL_PREFIX = "https://en.wikipedia.org/wiki/"
 
 LINKS_RE = re.compile(r"\[\[.*?\]\]")
 
-def main():
-    songs = db.load()
+# Id of the current revision of the list of songs.
+def latest_revision():
+    pages = json.load(urllib.request.urlopen(REVISION_URL))["query"]["pages"]
+    return next(iter(pages.values()))["revisions"][0]["revid"]
+
+# Download the wikitext of the list of songs, or return None if the page
+# hasn't been edited since the state was recorded (see source_state.py).
+# Doesn't touch the database.
+def fetch(state=None):
+    url = URL
+    if state is not None:
+        revision = latest_revision()
+        if state.get("revision") == revision:
+            return None
+        state["revision"] = revision
+        # The revision we checked, even if the page was edited since
+        url += f"&oldid={revision}"
 
-    main_page = urllib.request.urlopen(URL).read().decode("utf-8")
-    #main_page = open("x").read()
+    return urllib.request.urlopen(url).read().decode("utf-8")
+    #return open("x").read()
+
+def apply(songs, index, main_page=None):
+    if main_page is None:
+        main_page = fetch()
 
     sections = main_page.split("\n\n")
     sections = [section for section in sections if section.startswith("{|")]
@@ -42,7 +67,7 @@ def main():
             link = parts[0]
             title = parts[0] if len(parts) == 1 else parts[1]
             url = URL_PREFIX + link
-            song = db.get_song_by_title(songs, title)
+            song = index.get(title)
             if song:
                 song["wikipedia"] = {
                     "url": url,
@@ -50,6 +75,8 @@ def main():
             else:
                 print(f"Didn't find song \"{title}\"")
 
-    db.save(songs)
+def main():
+    import_all.main([SOURCE])
 
-main()
+if __name__ == "__main__":
+    main()
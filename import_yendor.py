@@ -1,28 +1,36 @@
 
 # Import data from https://www.yendor.com/Beatles/
 
-import urllib.request
 import json
-import db
+import import_all
+import source_state
+
+SOURCE = "yendor"
 
 URL = "https://www.yendor.com/Beatles/Beatles.json"
 
 # Keys we don't care about.
 BAD_KEYS = {'group', '_id', 'name', 'Other.releases'}
 
-def main():
-    songs = db.load()
+# Download the yendor songs, or return None if they haven't changed since the
+# state was recorded (see source_state.py). Doesn't touch the database.
+def fetch(state=None):
+    body = source_state.fetch_url(state, URL)
+    if body is None:
+        return None
+    return json.loads(body)["nodes"]
+
+def apply(songs, index, nodes=None):
+    if nodes is None:
+        nodes = fetch()
 
-    yendor_songs = json.load(urllib.request.urlopen(URL))
-    nodes = yendor_songs["nodes"]
-    all_keys = set()
     for node in nodes:
         if "Title" in node:
             title = node["Title"]
-            song = db.get_song_by_title(songs, title)
+            song = index.get(title)
             if song is None:
                 song = {"title": title}
-                songs.append(song)
+                index.add(song)
 
             yendor = {}
             for key in node.keys():
@@ -30,6 +38,8 @@ def main():
                     yendor[key.lower()] = node[key]
             song["yendor"] = yendor
 
-    db.save(songs)
+def main():
+    import_all.main([SOURCE])
 
-main()
+if __name__ == "__main__":
+    main()
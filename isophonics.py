@@ -0,0 +1,177 @@
+
+# Parsing and access for the isophonics annotations (the "isophonics"
+# sub-object of each song).
+#
+# Each annotation ("keylab", "seglab" or "chordlab") is stored in one of two
+# encodings. The original is a list with one dict per event:
+#
+#     [{"beginTime": 0.0, "endTime": 2.1, "chord": "E:maj"}, ...]
+#
+# The columnar one keeps the times as parallel lists and each label field as
+# a list of distinct labels plus one code (index into the labels, or -1 when
+# the field is missing) per event:
+#
+#     {"beginTime": [0.0, ...], "endTime": [2.1, ...],
+#      "chord": {"labels": ["E:maj", ...], "codes": [0, ...]}}
+#
+# Use events() to read either encoding as per-event dicts.
+
+try:
+    # pip install numpy
+    import numpy as np
+except ImportError:
+    np = None
+
+LAB_TYPES = ["keylab", "seglab", "chordlab"]
+
+# Label fields of the events of each annotation type, with the index of the
+# field in the .lab file line.
+LABEL_FIELDS = {
+    "keylab": [("sectionType", 2), ("key", 3)],
+    "seglab": [("segment", 3)],
+    "chordlab": [("chord", 2)],
+}
+
+# Split a .lab file's contents into lists of fields, one per line. The
+# pathname is only for warnings.
+def split_lines(lab_type, text, pathname=""):
+    rows = []
+
+    for line in text.strip().split("\n"):
+        if lab_type == "keylab":
+            fields = line.split("\t")
+        elif lab_type == "seglab":
+            fields = line.split("\t", 3)
+            if len(fields) != 4:
+                print("seg doesn't have 4 fields", pathname, fields)
+        else:
+            fields = line.split(" ")
+            if len(fields) != 3:
+                print("chord doesn't have 3 fields", pathname, fields)
+        rows.append(fields)
+
+    return rows
+
+# Value of a label field for a line of a .lab file, or None if the event
+# doesn't have it.
+def label_value(lab_type, field, index, fields):
+    if lab_type == "keylab" and field == "key" and fields[2] != "Key":
+        return None
+
+    return fields[index]
+
+# Parse a .lab file into the list of per-event dicts.
+def parse_events(lab_type, text, pathname=""):
+    infos = []
+
+    for fields in split_lines(lab_type, text, pathname):
+        info = {
+                "beginTime": float(fields[0]),
+                "endTime": float(fields[1]),
+        }
+        for field, index in LABEL_FIELDS[lab_type]:
+            value = label_value(lab_type, field, index, fields)
+            if value is not None:
+                info[field] = value
+        infos.append(info)
+
+    return infos
+
+# Parse a .lab file into NumPy arrays: float64 arrays for the begin and end
+# times, and for each label field a (labels, int32 codes) tuple.
+def parse_arrays(lab_type, text, pathname=""):
+    rows = split_lines(lab_type, text, pathname)
+    arrays = {
+        # NumPy converts the strings to floats in one go.
+        "beginTime": np.array([fields[0] for fields in rows], dtype=np.float64),
+        "endTime": np.array([fields[1] for fields in rows], dtype=np.float64),
+    }
+
+    for field, index in LABEL_FIELDS[lab_type]:
+        labels, codes = intern_labels(label_value(lab_type, field, index, fields)
+                                      for fields in rows)
+        arrays[field] = (labels, np.array(codes, dtype=np.int32))
+
+    return arrays
+
+# List of labels in order of first appearance, and list of codes for the
+# values (-1 for None).
+def intern_labels(values):
+    codes_by_label = {}
+    codes = [-1 if value is None else codes_by_label.setdefault(value, len(codes_by_label))
+             for value in values]
+
+    return list(codes_by_label), codes
+
+# Parse a .lab file into the columnar JSON encoding, through NumPy if it's
+# installed.
+def parse_columns(lab_type, text, pathname=""):
+    if np is None:
+        return events_to_json(lab_type, parse_events(lab_type, text, pathname))
+
+    return arrays_to_json(lab_type, parse_arrays(lab_type, text, pathname))
+
+# Columnar JSON encoding of the arrays from parse_arrays().
+def arrays_to_json(lab_type, arrays):
+    encoded = {
+        "beginTime": arrays["beginTime"].tolist(),
+        "endTime": arrays["endTime"].tolist(),
+    }
+
+    for field, _ in LABEL_FIELDS[lab_type]:
+        labels, codes = arrays[field]
+        encoded[field] = {"labels": labels, "codes": codes.tolist()}
+
+    return encoded
+
+# Arrays like parse_arrays() returns, from an annotation in either encoding.
+def json_to_arrays(lab_type, annotation):
+    if not is_columnar(annotation):
+        annotation = events_to_json(lab_type, annotation)
+
+    arrays = {
+        "beginTime": np.array(annotation["beginTime"], dtype=np.float64),
+        "endTime": np.array(annotation["endTime"], dtype=np.float64),
+    }
+
+    for field, _ in LABEL_FIELDS[lab_type]:
+        arrays[field] = (annotation[field]["labels"],
+                         np.array(annotation[field]["codes"], dtype=np.int32))
+
+    return arrays
+
+# Columnar JSON encoding of a list of per-event dicts, without NumPy.
+def events_to_json(lab_type, events):
+    encoded = {
+        "beginTime": [event["beginTime"] for event in events],
+        "endTime": [event["endTime"] for event in events],
+    }
+
+    for field, _ in LABEL_FIELDS[lab_type]:
+        labels, codes = intern_labels(event.get(field) for event in events)
+        encoded[field] = {"labels": labels, "codes": codes}
+
+    return encoded
+
+def is_columnar(annotation):
+    return isinstance(annotation, dict)
+
+# Yield the song's events of the annotation type as dicts, as in the original
+# encoding. Yields nothing if the song doesn't have the annotation.
+def events(song, lab_type):
+    annotation = song.get("isophonics", {}).get(lab_type)
+    if annotation is None:
+        return
+
+    if not is_columnar(annotation):
+        yield from annotation
+        return
+
+    label_fields = [(field, annotation[field]["labels"], annotation[field]["codes"])
+                    for field, _ in LABEL_FIELDS[lab_type]]
+    for i, (begin_time, end_time) in enumerate(zip(annotation["beginTime"], annotation["endTime"])):
+        event = {"beginTime": begin_time, "endTime": end_time}
+        for field, labels, codes in label_fields:
+            if codes[i] != -1:
+                event[field] = labels[codes[i]]
+        yield event
@@ -6,9 +6,125 @@ const tooltip = d3.select("body")
         .attr("class", "tooltip")
         .style("opacity", 0);
 
+// Names of the song's chords, from either encoding of isophonics.chordlab
+// (see isophonics.py).
+function chordNames(song) {
+    const chordlab = song.isophonics.chordlab;
+    if (Array.isArray(chordlab)) {
+        return chordlab.map(cl => cl.chord);
+    }
+    return chordlab.chord.codes.map(code => chordlab.chord.labels[code]);
+}
+
+// Number of distinct chords in the song, other than "no chord".
+function distinctChords(song) {
+    return new Set(chordNames(song).filter(chord => chord !== "N")).size;
+}
+
+function isNumber(value) {
+    return typeof value === "number" && Number.isFinite(value);
+}
+
+function top50Billboard(song) {
+    const value = song.yendor["top.50.billboard"];
+    return value === -1 ? undefined : value;
+}
+
+function composerSharePaul(song) {
+    const album = song.pannell?.album;
+    if (!isNumber(album?.Composer_share_John) || !isNumber(album?.Composer_share_Paul) ||
+        Math.abs(album.Composer_share_John + album.Composer_share_Paul - 1) >= 0.01) {
+        return undefined;
+    }
+    return album.Composer_share_Paul;
+}
+
+// The graphed metrics, as in build_stats.py. x is the year unless given.
+const METRICS = [
+    { id: "duration", title: "Duration (Seconds)", format: "4d", y: song => song.yendor.duration },
+    { id: "number_of_chords", title: "Number of Chords (Originals)", format: "4d",
+      y: song => song.pannell?.album?.Original_songs === 1 && song.isophonics?.chordlab !== undefined
+          ? distinctChords(song) : undefined },
+    { id: "number_of_takes", title: "Number of Takes", format: "4d", y: song => song.pannell?.album?.Takes },
+    { id: "tempo", title: "Tempo (BPM)", format: "4d", y: song => song.TheHoleGotFixed?.tempos?.[0] },
+    { id: "paul_billboard", title: "Paul Authorship (vs John) vs. Billboard", format: ".1f",
+      x: composerSharePaul, y: top50Billboard },
+    { id: "top50", title: "Top 50 Billboard", format: "4d", y: top50Billboard },
+    ...["acousticness", "danceability", "energy", "liveness", "speechiness", "valence"]
+        .map(field => ({ id: field, title: field[0].toUpperCase() + field.slice(1), format: "4d",
+                         y: song => song.chadwambles?.[field] })),
+];
+
+// Mean, standard deviation and count of the [x, y, ...] points at each x.
+function groupStats(points) {
+    return d3.rollups(points,
+                      d => ({ mean: d3.mean(d, p => p[1]), stddev: d3.deviation(d, p => p[1]) ?? 0, count: d.length }),
+                      p => p[0])
+        .map(([x, stats]) => ({ x, ...stats }))
+        .sort((a, b) => a.x - b.x);
+}
+
+// The contents of stats.json and song_points.json, computed from all the
+// songs like build_stats.py does.
+function buildStats(songs) {
+    const titles = [];
+    const lennon = [];
+    const points = Object.fromEntries(METRICS.map(metric => [metric.id, []]));
+
+    for (const song of songs) {
+        const year = song.yendor?.year;
+        if (!isNumber(year) || year < 1962 || year > 1970) {
+            continue;
+        }
+
+        const index = titles.length;
+        titles.push(song.title);
+        lennon.push(song.yendor.songwriter === "Lennon");
+
+        for (const metric of METRICS) {
+            const x = metric.x === undefined ? year : metric.x(song);
+            const y = metric.y(song);
+            if (isNumber(x) && isNumber(y)) {
+                points[metric.id].push([x, y, index]);
+            }
+        }
+    }
+
+    const stats = {
+        metrics: METRICS.map(({ id, title, format }) => ({ id, title, format })),
+        all: {},
+        lennon: {},
+    };
+    for (const metric of METRICS) {
+        stats.all[metric.id] = groupStats(points[metric.id]);
+        stats.lennon[metric.id] = groupStats(points[metric.id].filter(point => lennon[point[2]]));
+    }
+
+    return [stats, { titles, lennon, points }];
+}
+
 async function main() {
-    const songs = (await d3.json("beatles_songs.json"))
-        .filter(song => song.yendor !== undefined && song.yendor.year >= 1962 && song.yendor.year <= 1970);
+    // Built by build_stats.py. Where they haven't been built (e.g. a static
+    // copy of the repository), the same data is computed from
+    // beatles_songs.json.
+    let stats, songPoints;
+    try {
+        [stats, songPoints] = await Promise.all([
+            d3.json("stats.json"),
+            d3.json("song_points.json"),
+        ]);
+    } catch {
+        [stats, songPoints] = buildStats(await d3.json("beatles_songs.json"));
+    }
+
+    // Map from variant ("all" or "lennon") to map from metric id to points,
+    // built once so that toggling the filter only redraws.
+    const points = { all: {}, lennon: {} };
+    for (const metric of stats.metrics) {
+        points.all[metric.id] = songPoints.points[metric.id]
+            .map(([x, y, index]) => ({ x, y, title: songPoints.titles[index], lennon: songPoints.lennon[index] }));
+        points.lennon[metric.id] = points.all[metric.id].filter(point => point.lennon);
+    }
 
     // Declare the chart dimensions and margins.
     const width = 640;
@@ -18,10 +134,12 @@ async function main() {
     const marginBottom = 30;
     const marginLeft = 40;
 
-    function graph(id, title, format, songs, xFn, yFn) {
-        if (id === "foo") {
-            console.log(songs);
-        }
+    // Draw the points, and the mean and standard deviation at each x from
+    // stats.json.
+    function graph(id, title, format, songs, stats) {
+        const xFn = point => point.x;
+        const yFn = point => point.y;
+
         // Declare the x (horizontal position) scale.
         const x = d3.scaleLinear()
             .domain([d3.min(songs, xFn) - 1, d3.max(songs, xFn)])
@@ -127,18 +245,11 @@ async function main() {
                             .attr("r", 0)
                             .remove());
 
-        // Map from year to { mean, stdev } object.
-        const stats = d3.rollups(songs,
-                                 d => ({ mean: d3.mean(d, yFn), stddev: d3.deviation(d, yFn) }),
-                                 song => xFn(song))
-                                 .map(d => ({ year: d[0], mean: d[1].mean, stddev: d[1].stddev ?? 0 }))
-                                 .sort((a, b) => a.year - b.year);
-
         svg.select(".stddev-area")
             .data([stats])
             .transition()
             .attr("d", d3.area()
-                .x(d => x(d.year))
+                .x(d => x(d.x))
                 .y0(d => y(d.mean - d.stddev))
                 .y1(d => y(d.mean + d.stddev)));
 
@@ -146,72 +257,16 @@ async function main() {
             .data([stats])
             .transition()
             .attr("d", d3.line()
-                .x(d => x(d.year))
+                .x(d => x(d.x))
                 .y(d => y(d.mean)));
     }
 
-    function graphByYear(id, title, songs, yFn) {
-        graph(id, title, "4d", songs, song => song.yendor.year, yFn);
-    }
-
-    function refresh(doFiltering) {
-        let filteredSongs = songs;
-        if (doFiltering) {
-            filteredSongs = filteredSongs.filter(song => song.yendor.songwriter === "Lennon");
+    function refresh(lennonOnly) {
+        const variant = lennonOnly ? "lennon" : "all";
+        for (const metric of stats.metrics) {
+            graph(metric.id, metric.title, metric.format,
+                  points[variant][metric.id], stats[variant][metric.id]);
         }
-
-        graphByYear("duration",
-              "Duration (Seconds)",
-              filteredSongs,
-              song => song.yendor.duration);
-        graphByYear("number_of_chords",
-              "Number of Chords (Originals)",
-              filteredSongs.filter(song => song.isophonics?.chordlab !== undefined && song.pannell?.album?.Original_songs === 1),
-              song => new Set(song.isophonics.chordlab.map(cl => cl.chord).filter(chord => chord !== "N")).size);
-        graphByYear("number_of_takes",
-              "Number of Takes",
-              filteredSongs.filter(song => song.pannell?.album !== undefined),
-              song => song.pannell.album.Takes);
-        graphByYear("tempo",
-              "Tempo (BPM)",
-              filteredSongs.filter(song => song.TheHoleGotFixed !== undefined),
-              song => song.TheHoleGotFixed.tempos[0]);
-        graph("paul_billboard",
-              "Paul Authorship (vs John) vs. Billboard",
-              ".1f",
-              filteredSongs.filter(song => song.pannell !== undefined &&
-                                   song.yendor["top.50.billboard"] !== -1 &&
-                                   Math.abs(song.pannell.album.Composer_share_John + song.pannell.album.Composer_share_Paul - 1) < 0.01),
-              song => song.pannell.album.Composer_share_Paul,
-              song => song.yendor["top.50.billboard"]);
-        graphByYear("top50",
-              "Top 50 Billboard",
-              filteredSongs.filter(song => song.yendor["top.50.billboard"] !== -1),
-              song => song.yendor["top.50.billboard"]);
-        graphByYear("acousticness",
-              "Acousticness",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.acousticness);
-        graphByYear("danceability",
-              "Danceability",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.danceability);
-        graphByYear("energy",
-              "Energy",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.energy);
-        graphByYear("liveness",
-              "Liveness",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.liveness);
-        graphByYear("speechiness",
-              "Speechiness",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.speechiness);
-        graphByYear("valence",
-              "Valence",
-              filteredSongs.filter(song => song.chadwambles !== undefined),
-              song => song.chadwambles.valence);
     }
 
     refresh(false);
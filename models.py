@@ -0,0 +1,240 @@
+
+# Compact in-memory model of the songs, for analysis scripts that keep the
+# whole database in memory. Each song and sub-object is an instance of a
+# class with __slots__ instead of a dict, repeated strings (chord, key and
+# segment labels, songwriters, albums) are interned, and the isophonics
+# events are stored as arrays of times and label codes, like the columnar
+# encoding (see isophonics.py).
+#
+#     >>> songs = models.load(["title", "yendor", "isophonics"])
+#     >>> [song.title for song in songs if song.yendor and song.yendor.year == 1965]
+#     >>> songs[0].isophonics.chordlab.labels_of("chord")[:4]
+#
+# The conversion is lossless: Song.from_json(song).to_json() == song. Keys
+# that have no slot (and known keys whose value is null) are kept in each
+# object's "extra" dict; missing keys read as None. Sub-objects that aren't
+# JSON objects, and annotations that the arrays wouldn't give back exactly,
+# are kept as their JSON value.
+
+import sys
+from array import array
+
+import db
+import isophonics
+
+# Slots of a Record subclass with the given FIELDS.
+def slots(fields):
+    return tuple(attribute for attribute, _, _ in fields)
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+# Whether the JSON values are equal and of the same types, unlike ==, for
+# which 0 == 0.0 == False although they're written differently.
+def same_json(a, b):
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same_json(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return len(a) == len(b) and all(map(same_json, a, b))
+    return a == b
+
+# Object with a slot for each of FIELDS, a list of (attribute, JSON key,
+# converter). The converter makes the attribute's value from the JSON value
+# (e.g. a nested Record's from_json()), or is None to keep the value as is.
+# Values that aren't Records are written back unchanged. from_json() returns
+# data itself if it isn't a dict.
+class Record:
+    __slots__ = ("extra",)
+    FIELDS = []
+    # Set of the FIELDS' JSON keys.
+    KEYS = set()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.KEYS = {key for _, key, _ in cls.FIELDS}
+
+    @classmethod
+    def from_json(cls, data):
+        if not isinstance(data, dict):
+            return data
+
+        record = cls.__new__(cls)
+        extra = None
+
+        for attribute, key, convert in cls.FIELDS:
+            value = data.get(key)
+            if value is None:
+                if key in data:
+                    extra = extra or {}
+                    extra[key] = None
+            elif convert is not None:
+                value = convert(value)
+            else:
+                value = intern_value(value)
+            setattr(record, attribute, value)
+
+        for key, value in data.items():
+            if key not in cls.KEYS:
+                extra = extra or {}
+                extra[key] = value
+
+        # None rather than an empty dict, to save memory.
+        record.extra = extra
+        return record
+
+    def to_json(self):
+        data = {}
+
+        for attribute, key, _ in self.FIELDS:
+            value = getattr(self, attribute)
+            if value is not None:
+                data[key] = value.to_json() if isinstance(value, (Record, Annotation)) else value
+
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_json()!r})"
+
+class YendorInfo(Record):
+    FIELDS = [
+        ("title", "title", None),
+        ("year", "year", None),
+        ("songwriter", "songwriter", None),
+        ("duration", "duration", None),
+        ("top_50_billboard", "top.50.billboard", None),
+    ]
+    __slots__ = slots(FIELDS)
+
+# One version (album or single) of a song in the pannell data.
+class PannellTrack(Record):
+    FIELDS = [
+        ("song_title", "Song_title", None),
+        ("takes", "Takes", None),
+        ("original_songs", "Original_songs", None),
+        ("composer_share_john", "Composer_share_John", None),
+        ("composer_share_paul", "Composer_share_Paul", None),
+        ("comments", "comments", None),
+    ]
+    __slots__ = slots(FIELDS)
+
+class PannellInfo(Record):
+    FIELDS = [
+        ("album", "album", PannellTrack.from_json),
+        ("single", "single", PannellTrack.from_json),
+    ]
+    __slots__ = slots(FIELDS)
+
+class ChadwamblesInfo(Record):
+    FIELDS = [(key, key, None) for key in ["year", "album", "song", "danceability", "energy",
+                                           "speechiness", "acousticness", "liveness", "valence",
+                                           "duration_ms"]]
+    __slots__ = slots(FIELDS)
+
+class WikipediaInfo(Record):
+    FIELDS = [("url", "url", None)]
+    __slots__ = slots(FIELDS)
+
+class TheHoleGotFixedInfo(Record):
+    FIELDS = [
+        ("tempos", "tempos", None),
+        ("key", "key", None),
+    ]
+    __slots__ = slots(FIELDS)
+
+# One isophonics annotation: the events' begin and end times as arrays of
+# doubles, and for each label field of the annotation type a tuple of
+# distinct (interned) labels and an array of codes into it, -1 when the
+# event doesn't have the field. Remembers which encoding it was read from, to
+# write it back the same way.
+class Annotation:
+    __slots__ = ("lab_type", "begin_times", "end_times", "labels", "codes", "columnar")
+
+    # The annotation in either JSON encoding. Returns the JSON value itself if
+    # to_json() wouldn't give it back exactly, e.g. if it has keys that the
+    # model doesn't keep or integer times.
+    @classmethod
+    def from_json(cls, lab_type, value):
+        columnar = isophonics.is_columnar(value)
+        try:
+            encoded = value if columnar else isophonics.events_to_json(lab_type, value)
+
+            annotation = cls.__new__(cls)
+            annotation.lab_type = lab_type
+            annotation.begin_times = array("d", encoded["beginTime"])
+            annotation.end_times = array("d", encoded["endTime"])
+            annotation.labels = {}
+            annotation.codes = {}
+            for field, _ in isophonics.LABEL_FIELDS[lab_type]:
+                annotation.labels[field] = tuple(sys.intern(label) for label in encoded[field]["labels"])
+                annotation.codes[field] = array("i", encoded[field]["codes"])
+            annotation.columnar = columnar
+
+            if same_json(annotation.to_json(), value):
+                return annotation
+        except (AttributeError, KeyError, IndexError, TypeError, ValueError, OverflowError):
+            pass
+
+        return value
+
+    def to_json(self):
+        encoded = {
+            "beginTime": self.begin_times.tolist(),
+            "endTime": self.end_times.tolist(),
+        }
+        for field, labels in self.labels.items():
+            encoded[field] = {"labels": list(labels), "codes": self.codes[field].tolist()}
+
+        if self.columnar:
+            return encoded
+        return list(isophonics.events({"isophonics": {self.lab_type: encoded}}, self.lab_type))
+
+    def __len__(self):
+        return len(self.begin_times)
+
+    # The label field's value for each event, None where it's missing.
+    def labels_of(self, field):
+        labels = self.labels[field]
+        return [None if code == -1 else labels[code] for code in self.codes[field]]
+
+    # Yield the events as dicts, as isophonics.events() does.
+    def events(self):
+        return isophonics.events({"isophonics": {self.lab_type: self.to_json()}}, self.lab_type)
+
+    def __repr__(self):
+        return f"Annotation({self.lab_type!r}, {len(self)} events)"
+
+class IsophonicsAnnotations(Record):
+    FIELDS = [(lab_type, lab_type, lambda value, lab_type=lab_type: Annotation.from_json(lab_type, value))
+              for lab_type in isophonics.LAB_TYPES]
+    __slots__ = slots(FIELDS)
+
+class Song(Record):
+    FIELDS = [
+        ("title", "title", None),
+        ("other_titles", "other_titles", None),
+        ("yendor", "yendor", YendorInfo.from_json),
+        ("pannell", "pannell", PannellInfo.from_json),
+        ("chadwambles", "chadwambles", ChadwamblesInfo.from_json),
+        ("wikipedia", "wikipedia", WikipediaInfo.from_json),
+        ("the_hole_got_fixed", "TheHoleGotFixed", TheHoleGotFixedInfo.from_json),
+        ("isophonics", "isophonics", IsophonicsAnnotations.from_json),
+    ]
+    __slots__ = slots(FIELDS)
+
+# List of Songs from the database, converted as they're read. If fields is
+# given, only those top-level keys are loaded (see db.iter_songs()), the
+# others read as None, and the list can't be saved.
+def load(fields=None):
+    songs = [Song.from_json(song) for song in db.iter_songs(fields)]
+    return songs if fields is None else db.PartialSongs(songs, fields)
+
+# Save the Songs to the database. Returns whether anything was written.
+def save(songs):
+    if isinstance(songs, db.PartialSongs):
+        raise ValueError(f"Can't save songs loaded with only the fields {songs.fields}")
+
+    return db.save([song.to_json() for song in songs])
@@ -1,5 +1,6 @@
 
 import db
+import source_state
 
 def main():
     songs = db.load()
@@ -10,5 +11,9 @@ def main():
 
     db.save(songs)
 
-main()
+    # So that import_pannell.py imports it again even if it hasn't changed.
+    source_state.forget(["pannell"])
+
+if __name__ == "__main__":
+    main()
 
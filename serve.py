@@ -0,0 +1,291 @@
+
+# Development server for the graphs page, replacing "python -m http.server".
+#
+# - Handles requests in threads.
+# - Serves the pre-built .br or .gz variant of a file when the client accepts
+#   that encoding and the variant's mtime equals the file's, which
+#   --precompress sets when it builds them (.br needs "pip install brotli").
+# - Sends strong ETags derived from the content hash and answers
+#   If-None-Match with 304 Not Modified.
+# - Supports single-range requests (Range, If-Range).
+#
+#     % python serve.py [--precompress] [--bind ADDRESS] [--directory DIR] [PORT]
+
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import http.server
+
+try:
+    # pip install brotli
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_PORT = 8000
+
+# Files worth precompressing, by extension, and the smallest worth doing.
+COMPRESSIBLE_EXTENSIONS = {".json", ".js", ".css", ".html", ".svg", ".txt", ".csv", ".tsv"}
+MIN_COMPRESS_SIZE = 1024
+
+# Content-Encoding and file extension of the precompressed variants, in order
+# of preference.
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+COPY_SIZE = 64*1024
+
+# Map from (pathname, mtime_ns, size) to ETag. Entries for old versions of a
+# file are just never looked up again.
+etags = {}
+etags_lock = threading.Lock()
+
+def file_etag(pathname, stat):
+    key = (pathname, stat.st_mtime_ns, stat.st_size)
+    with etags_lock:
+        etag = etags.get(key)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(pathname, "rb") as f:
+            for chunk in iter(lambda: f.read(COPY_SIZE), b""):
+                digest.update(chunk)
+        etag = '"' + digest.hexdigest()[:32] + '"'
+        with etags_lock:
+            etags[key] = etag
+    return etag
+
+# Set of content codings the Accept-Encoding header allows.
+def accepted_encodings(header):
+    encodings = set()
+    for item in (header or "").split(","):
+        name, _, parameters = item.strip().partition(";")
+        quality = parameters.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:] or 0) == 0:
+                    continue
+            except ValueError:
+                # Malformed, e.g. "q=abc": ignore the q-value.
+                pass
+        encodings.add(name.strip().lower())
+    return encodings
+
+# (start, end) byte positions (end inclusive) of a single-range Range header,
+# None to ignore the header, or "unsatisfiable".
+def parse_range(header, size):
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, dash, last = ranges.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return "unsatisfiable"
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        return "unsatisfiable"
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Otherwise a small body written after the headers on a kept-alive
+    # connection waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, "index.html")
+            if not self.path.split("?", 1)[0].endswith("/") or not os.path.isfile(index):
+                # Redirects and directory listings
+                return super().do_GET() if send_body else super().do_HEAD()
+            path = index
+
+        try:
+            source_stat = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        content_type = self.guess_type(path)
+        served_path, encoding = self.choose_variant(path, source_stat)
+        stat = source_stat if encoding is None else os.stat(served_path)
+        etag = file_etag(served_path, stat)
+
+        if self.etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_common_headers(etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        size = stat.st_size
+        byte_range = None
+        if "Range" in self.headers:
+            if_range = self.headers.get("If-Range")
+            if if_range is None or if_range.strip() == etag:
+                byte_range = parse_range(self.headers["Range"], size)
+
+        if byte_range == "unsatisfiable":
+            self.send_response(416)
+            self.send_common_headers(etag)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if byte_range is None:
+            start, end = 0, size - 1
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+        self.send_common_headers(etag)
+        self.send_header("Content-Type", content_type)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Last-Modified", self.date_time_string(int(source_stat.st_mtime)))
+        self.end_headers()
+
+        if send_body:
+            with open(served_path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(COPY_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    # (pathname, Content-Encoding) of the best variant of the file the
+    # client accepts; the encoding is None for the file itself.
+    def choose_variant(self, path, source_stat):
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding"))
+        for encoding, extension in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                variant_stat = os.stat(path + extension)
+            except OSError:
+                continue
+            # precompress() gives variants the file's modification time, so
+            # any other time means a variant of another version of the file
+            # (which may even be newer, e.g. after restoring a backup).
+            if variant_stat.st_mtime_ns == source_stat.st_mtime_ns:
+                return path + extension, encoding
+        return path, None
+
+    def etag_matches(self, header, etag):
+        if header is None:
+            return False
+        tags = [tag.strip() for tag in header.split(",")]
+        # Weak comparison, as If-None-Match uses
+        return "*" in tags or etag in tags or "W/" + etag in tags
+
+    def send_common_headers(self, etag):
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+        # Always revalidate, which is cheap with the ETag
+        self.send_header("Cache-Control", "no-cache")
+
+# Write the data to the pathname, with the source file's timestamps.
+def write_variant(pathname, source_pathname, data):
+    fd, tmp_pathname = tempfile.mkstemp(dir=os.path.dirname(pathname) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        shutil.copystat(source_pathname, tmp_pathname)
+        os.replace(tmp_pathname, pathname)
+    except BaseException:
+        os.remove(tmp_pathname)
+        raise
+
+# Write .gz (and .br, if brotli is installed) variants of the compressible
+# files under the directory that don't have an up-to-date one. Returns the
+# number of variants written.
+def precompress(directory):
+    compressors = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    written = 0
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith(".")]
+        for filename in filenames:
+            pathname = os.path.join(root, filename)
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            stat = os.stat(pathname)
+            if stat.st_size < MIN_COMPRESS_SIZE:
+                continue
+
+            data = None
+            for extension, compress in compressors:
+                try:
+                    if os.stat(pathname + extension).st_mtime_ns == stat.st_mtime_ns:
+                        continue
+                except OSError:
+                    pass
+                if data is None:
+                    with open(pathname, "rb") as f:
+                        data = f.read()
+                # Copying the source's mtime marks the variant as up to date
+                write_variant(pathname + extension, pathname, compress(data))
+                written += 1
+
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the graphs page.")
+    parser.add_argument("port", nargs="?", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--bind", default="", help="address to listen on (default: all)")
+    parser.add_argument("--directory", default=os.getcwd(), help="directory to serve")
+    parser.add_argument("--precompress", action="store_true",
+                        help="build missing or stale .gz/.br variants first")
+    args = parser.parse_args()
+
+    if args.precompress:
+        print(f"Precompressed {precompress(args.directory)} files")
+        if brotli is None:
+            print("Install brotli to also build .br variants.")
+
+    def handler(*handler_args, **kwargs):
+        return Handler(*handler_args, directory=args.directory, **kwargs)
+
+    with http.server.ThreadingHTTPServer((args.bind, args.port), handler) as server:
+        host, port = server.server_address[:2]
+        print(f"Serving {args.directory} on http://{host or 'localhost'}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+if __name__ == "__main__":
+    main()
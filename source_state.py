@@ -0,0 +1,152 @@
+
+# What each source's inputs looked like when they were last imported, so that
+# an importer whose inputs haven't changed can skip re-reading them.
+#
+# The state file is an object keyed by source name, e.g.:
+#
+#     {"chadwambles": {"files": {"TheBeatlesCleaned.csv":
+#                          {"mtimeNs": ..., "size": ..., "sha256": "..."}}},
+#      "yendor": {"http": {"https://...": {"ETag": "...", "Last-Modified": "..."}}},
+#      "wikipedia": {"revision": 1234567890}, ...}
+#
+# An importer's fetch() takes the source's state (from load()), updates it in
+# place as it reads its inputs, and returns None if they're all unchanged.
+# The updated state is only saved (with save()) after the database is, so an
+# import that fails is redone on the next run.
+#
+# Unchanged inputs only mean there's nothing to import if the database is the
+# one they were imported into: rows that matched no song match one once it's
+# added, and a database restored from a backup or stored in another layout
+# may not have the source's data at all. So import_all.py also records in
+# each source's state the database_digest() after the import, and imports a
+# source from scratch when the database's digest differs. The fingerprint of
+# the database file is kept under the DATABASE key.
+
+import os
+import json
+import time
+import hashlib
+import urllib.error
+import urllib.request
+
+import db
+
+FILENAME = "import_state.json"
+
+# Key of the state file that isn't a source (see database_digest()).
+DATABASE = "database"
+
+# Files modified less than this many nanoseconds before they're checked are
+# hashed again on the next check.
+RACY_NS = 2*1000*1000*1000
+
+# Response headers used to revalidate a download.
+VALIDATOR_HEADERS = ["ETag", "Last-Modified"]
+
+def load_all(filename=FILENAME):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# The state of the named source, empty if it was never imported.
+def load(name, filename=FILENAME):
+    return load_all(filename).get(name, {})
+
+# Record the state of the sources, given a map from source name to state.
+def save(states, filename=FILENAME):
+    all_states = load_all(filename)
+    all_states.update(states)
+
+    encoder = json.JSONEncoder(sort_keys=True, indent=4)
+    db.write_atomically(filename, encoder.iterencode(all_states))
+
+# Forget the named sources, so that they're all re-imported next time.
+def forget(names, filename=FILENAME):
+    all_states = load_all(filename)
+    if any(all_states.pop(name, None) is not None for name in list(names)):
+        encoder = json.JSONEncoder(sort_keys=True, indent=4)
+        db.write_atomically(filename, encoder.iterencode(all_states))
+
+# Whether the file differs from when the state was recorded, recording its
+# current fingerprint. The file is only hashed if its modification time or
+# size changed, so checking an unchanged file costs one stat().
+def file_changed(state, pathname):
+    files = state.setdefault("files", {})
+    previous = files.get(pathname)
+    stat = os.stat(pathname)
+
+    if previous is not None and previous["mtimeNs"] == stat.st_mtime_ns and previous["size"] == stat.st_size:
+        return False
+
+    fingerprint = {"mtimeNs": stat.st_mtime_ns, "size": stat.st_size, "sha256": db.file_digest(pathname)}
+    # A file modified moments ago could be modified again without its
+    # modification time changing, since some file systems have coarse
+    # timestamps. Hash it again next time.
+    if time.time_ns() - stat.st_mtime_ns < RACY_NS:
+        fingerprint["mtimeNs"] = None
+    files[pathname] = fingerprint
+
+    # A file that was only touched is unchanged.
+    return previous is None or previous["sha256"] != fingerprint["sha256"]
+
+# Download the URL, or return None if it's unchanged since the state was
+# recorded. Sends the validators of the previous download, so that the server
+# can answer 304 Not Modified without sending it, and records the new ones.
+# Servers that send no validators are checked by the hash of the body. If
+# state is None, always downloads.
+def fetch_url(state, url):
+    if state is None:
+        with urllib.request.urlopen(url) as response:
+            return response.read()
+
+    validators = state.setdefault("http", {}).get(url, {})
+    headers = {}
+    if "ETag" in validators:
+        headers["If-None-Match"] = validators["ETag"]
+    if "Last-Modified" in validators:
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            body = response.read()
+            response_headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+    sha256 = hashlib.sha256(body).hexdigest()
+    state["http"][url] = {name: response_headers[name]
+                          for name in VALIDATOR_HEADERS if name in response_headers}
+    state["http"][url]["sha256"] = sha256
+
+    return None if validators.get("sha256") == sha256 else body
+
+# File whose contents identify the database in each storage layout (see
+# db.STORAGE). The manifest lists the content hash of every shard.
+def database_filename():
+    if db.STORAGE == "shards":
+        return os.path.join(db.SHARD_DIR, db.MANIFEST_FILENAME)
+    if db.STORAGE == "sqlite":
+        import db_sqlite
+        return db_sqlite.FILENAME
+    return db.FILENAME
+
+# Digest of the database's contents and layout, or None if there's no
+# database yet. The file's fingerprint is recorded in state, so an unchanged
+# file isn't hashed again.
+def database_digest(state):
+    filename = database_filename()
+    if not os.path.exists(filename):
+        return None
+
+    file_changed(state, filename)
+    return db.STORAGE + ":" + state["files"][filename]["sha256"]
+
+# Digest of all the songs' titles and other titles, which decide what the
+# sources' rows match.
+def titles_digest(songs):
+    titles = sorted({title for song in songs for title in [song["title"]] + song.get("other_titles", [])})
+    return hashlib.sha256("\n".join(titles).encode("utf-8")).hexdigest()
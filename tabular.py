@@ -0,0 +1,115 @@
+
+# Read CSV and TSV inputs (e.g. TheBeatlesCleaned.csv, TheHoleGotFixed.tsv)
+# into typed columns, and match their titles to songs.
+#
+# The columns to read are given as a schema, a list of (key, header, type).
+# The type is "str", "int", "float", or a function that converts the cell's
+# string. A byte order mark is skipped, and the delimiter is whichever of
+# DELIMITERS the header line has most of.
+#
+# The file is parsed with pandas if it's installed, which reads millions of
+# rows in a few seconds, and with the csv module otherwise.
+#
+#     >>> table = tabular.read("TheBeatlesCleaned.csv", [("title", "song", "str"),
+#     ...                                                ("energy", "energy", "float")])
+#     >>> table["energy"][:2]
+#     [0.801, 0.605]
+
+import csv
+
+DELIMITERS = [",", "\t", ";", "|"]
+
+# The file's rows start on this line, after the header.
+FIRST_ROW_NUMBER = 2
+
+# How many unmatched titles print_unmatched() lists.
+MAX_REPORTED_TITLES = 50
+
+PANDAS_DTYPES = {"str": str, "int": "int64", "float": "float64"}
+PYTHON_TYPES = {"str": str, "int": int, "float": float}
+
+def detect_delimiter(header_line):
+    return max(DELIMITERS, key=header_line.count)
+
+# Map from key to list of the column's values, in row order.
+def read(filename, columns):
+    with open(filename, encoding="utf-8-sig", newline="") as f:
+        delimiter = detect_delimiter(f.readline())
+
+    # pip install pandas. Imported here, not at the top, because importing it
+    # takes longer than an import_all.py run whose inputs haven't changed.
+    try:
+        import pandas
+    except ImportError:
+        return read_with_csv(filename, columns, delimiter)
+
+    return read_with_pandas(pandas, filename, columns, delimiter)
+
+def read_with_pandas(pandas, filename, columns, delimiter):
+    headers = [header for _, header, _ in columns]
+    dtypes = {header: PANDAS_DTYPES.get(column_type, str) if isinstance(column_type, str) else str
+              for _, header, column_type in columns}
+    try:
+        frame = pandas.read_csv(filename, sep=delimiter, encoding="utf-8-sig", usecols=headers,
+                                dtype=dtypes, na_filter=False)
+    except ValueError as e:
+        raise ValueError(f"{filename}: {e}") from e
+
+    table = {}
+    for key, header, column_type in columns:
+        # tolist() gives Python ints and floats, which the json module takes.
+        values = frame[header].tolist()
+        if not isinstance(column_type, str):
+            values = list(map(column_type, values))
+        table[key] = values
+
+    return table
+
+def read_with_csv(filename, columns, delimiter):
+    with open(filename, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header_row = next(reader, [])
+        rows = list(reader)
+
+    table = {}
+    for key, header, column_type in columns:
+        if header not in header_row:
+            raise ValueError(f"{filename}: no column {header!r}")
+        position = header_row.index(header)
+        convert = PYTHON_TYPES[column_type] if isinstance(column_type, str) else column_type
+        table[key] = list(map(convert, (row[position] for row in rows)))
+
+    return table
+
+# List of the song for each title, or None if there's none. Each distinct
+# title is only looked up once.
+def match_titles(index, titles):
+    songs = {}
+    for title in titles:
+        if title not in songs:
+            songs[title] = index.get(title)
+
+    return [songs[title] for title in titles]
+
+# List of (row number, title) of the rows whose title has no song. Row numbers
+# count the header as line 1.
+def unmatched_rows(titles, matched_songs):
+    return [(row_number, title)
+            for row_number, (title, song) in enumerate(zip(titles, matched_songs), FIRST_ROW_NUMBER)
+            if song is None]
+
+# Print the unmatched rows, once per title.
+def print_unmatched(unmatched, filename):
+    row_numbers_by_title = {}
+    for row_number, title in unmatched:
+        row_numbers_by_title.setdefault(title, []).append(row_number)
+
+    for title, row_numbers in list(row_numbers_by_title.items())[:MAX_REPORTED_TITLES]:
+        rows = "row" if len(row_numbers) == 1 else "rows"
+        shown = ", ".join(str(row_number) for row_number in row_numbers[:5])
+        if len(row_numbers) > 5:
+            shown += ", ..."
+        print(f"Can't find song \"{title}\" ({filename} {rows} {shown})")
+
+    if len(row_numbers_by_title) > MAX_REPORTED_TITLES:
+        print(f"... and {len(row_numbers_by_title) - MAX_REPORTED_TITLES} more titles not found")